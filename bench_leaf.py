@@ -0,0 +1,399 @@
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from leaf_analysis import analyze_leaf, analyze_leaves, analyze_tiled, disease_diagnosis, rgb_histogram
+from leaf_bands import BAND_NAMES, BANDS, DEFAULT_MAX_SIDE, band_preview, classify_bands, overlay_bands, resize_to_width
+from leaf_decode import decode_image
+from leaf_rules import ph_statuses
+from leaf_segment import leaf_roi
+from leaf_tuning import rescore, result_histogram, summed_area_table
+
+# สีสังเคราะห์ (HSV แบบ OpenCV) ที่เลือกให้อยู่กลางช่วงของแถบสี พร้อมแถบที่สีนั้นต้องตกอยู่
+SYNTHETIC_COLORS = (
+    ("healthy", (60, 200, 150), ()),
+    ("brown", (12, 200, 150), ("brown",)),
+    ("yellow", (35, 200, 200), ("yellow",)),
+    ("purple", (140, 200, 150), ("purple",)),
+    ("edge_brown", (7, 200, 70), ("edge_brown", "dark_brown")),
+    ("gray", (0, 10, 200), ("gray",)),
+    ("pale_yellow", (33, 30, 200), ("pale_yellow",)),
+)
+# สัดส่วนพื้นที่ของแต่ละสี (ผลรวม 1)
+SYNTHETIC_FRACTIONS = (0.55, 0.08, 0.12, 0.06, 0.07, 0.05, 0.07)
+
+# ความละเอียดที่ทดสอบ: ชื่อ -> (กว้าง, สูง)
+RESOLUTIONS = {
+    "0.3MP": (640, 480),
+    "2MP": (1600, 1200),
+    "12MP": (4000, 3000),
+    "48MP": (8000, 6000),
+}
+# ความคลาดเคลื่อนที่ยอมรับของการแยกใบ (จุดเปอร์เซ็นต์) mask สร้างจากภาพย่อ ขอบใบจึงคลาดได้ราวหนึ่งพิกเซลของภาพย่อ
+SEGMENT_TOLERANCE = 1.5
+# พื้นหลังของภาพทดสอบการแยกใบ: ชื่อ -> (HSV ครึ่งบน, HSV ครึ่งล่าง)
+SCENE_BACKGROUNDS = {
+    "black": ((0, 0, 10), (0, 0, 10)),
+    "sky": ((100, 10, 230), (90, 30, 40)),
+    "paper": ((0, 0, 235), (0, 0, 235)),
+    "skin": ((10, 90, 210), (10, 90, 210)),
+    "soil": ((15, 150, 60), (15, 150, 60)),
+}
+# บนพื้นหลังสีเดียวกับแผลสีน้ำตาล แผลที่ขอบใบต่อเป็นส่วนเดียวกับพื้นหลังและไม่ถูกนับเป็นใบ (ข้อจำกัดที่รู้อยู่)
+# จึงทดสอบแผลที่ขอบใบเฉพาะพื้นหลังอื่น
+MARGIN_LESION_BACKGROUNDS = ("black", "sky", "paper")
+STAGES = ("decode", "segment", "hsv", "masking", "highlight", "histogram", "diagnosis", "analyze_leaf",
+          "analyze_leaf_segmented")
+# ขั้นตอนที่จับเวลาการคำนวณแบบเดิมควบคู่กัน: ขั้นตอน -> ขั้นตอนแบบเดิมที่ใช้เทียบ
+# (analyze_leaf ทั้งสองแบบเทียบกับ analyze_leaf แบบเดิมที่ความละเอียดเต็มและไม่แยกใบ)
+REFERENCE_STAGES = {
+    "masking": "masking",
+    "highlight": "highlight",
+    "diagnosis": "diagnosis",
+    "analyze_leaf": "analyze_leaf",
+    "analyze_leaf_segmented": "analyze_leaf",
+}
+
+
+def synthetic_leaf(width, height):
+    # สร้างภาพเป็นแถบแนวนอนของแต่ละสีตามสัดส่วน คืน (ภาพ RGB, เปอร์เซ็นต์ที่คาดหวังของแต่ละแถบ)
+    rows = np.round(np.cumsum((0,) + SYNTHETIC_FRACTIONS) * height).astype(int)
+    hsv = np.zeros((height, 1, 3), dtype=np.uint8)
+    expected = dict.fromkeys(BAND_NAMES, 0.0)
+    for (_, color, bands), top, bottom in zip(SYNTHETIC_COLORS, rows[:-1], rows[1:]):
+        hsv[top:bottom] = color
+        for band in bands:
+            expected[band] += (bottom - top) / height * 100
+    rgb = cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)
+    return np.ascontiguousarray(np.broadcast_to(rgb, (height, width, 3))), expected
+
+
+def synthetic_closeup(width, height):
+    # ภาพระยะใกล้ที่ใบเต็มภาพ มีขอบไหม้สีน้ำตาล (20% ของความกว้างภาพ) แตะขอบภาพด้านขวา ต้องวิเคราะห์ทั้งภาพ
+    # คืน (ภาพ RGB, brown_pct ที่คาดหวัง)
+    lesion = width - round(width * 0.2)
+    hsv = np.zeros((1, width, 3), dtype=np.uint8)
+    hsv[0, :lesion] = (60, 200, 150)
+    hsv[0, lesion:] = (12, 200, 150)
+    rgb = cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)
+    return np.ascontiguousarray(np.broadcast_to(rgb, (height, width, 3))), (width - lesion) / width * 100
+
+
+def synthetic_scene(width, height, background, lesion=None):
+    # ใบรูปวงรีบนพื้นหลังใน SCENE_BACKGROUNDS (ใบล้ำเข้าไปในครึ่งบนของภาพ) lesion: None = ใบปกติ,
+    # "spot" = แผลสีน้ำตาลกลางใบ, "margin" = ขอบใบด้านขวาไหม้สีน้ำตาล คืน (ภาพ RGB, mask ของใบจริง)
+    top, bottom = SCENE_BACKGROUNDS[background]
+    hsv = np.empty((height, width, 3), dtype=np.uint8)
+    hsv[:height // 2], hsv[height // 2:] = top, bottom
+    center, axes = (width // 2, height // 2 + height // 20), (width * 3 // 8, height * 3 // 10)
+    leaf = cv2.ellipse(np.zeros((height, width), np.uint8), center, axes, 0, 0, 360, 255, -1)
+    hsv[leaf > 0] = (60, 200, 150)
+    spots = np.zeros_like(leaf)
+    if lesion == "spot":
+        cv2.circle(spots, (width * 3 // 7, center[1]), width // 16, 255, -1)
+    elif lesion == "margin":
+        shifted = cv2.ellipse(np.zeros_like(leaf), (center[0] - width // 20, center[1]), axes, 0, 0, 360, 255, -1)
+        spots = leaf & ~shifted
+    hsv[(spots & leaf) > 0] = (12, 200, 150)
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB), leaf
+
+
+def synthetic_leaves(width, height):
+    # ใบสี่เหลี่ยมสามใบบนพื้นหลังสีดำ แต่ละใบมีอาการคนละสี (30% ของความกว้างใบ) สำหรับตรวจการวิเคราะห์ทีละใบ
+    hsv = np.zeros((height, width, 3), dtype=np.uint8)
+    hsv[...] = (0, 0, 10)
+    for i, symptom in enumerate(((12, 200, 150), (35, 200, 200), (140, 200, 150))):
+        left, right = round(width * (0.05 + 0.32 * i)), round(width * (0.27 + 0.32 * i))
+        lesion = right - round((right - left) * 0.3)
+        hsv[round(height * 0.2):round(height * 0.8), left:lesion] = (60, 200, 150)
+        hsv[round(height * 0.2):round(height * 0.8), lesion:right] = symptom
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)
+
+
+def synthetic_touching_leaves(width, height):
+    # ใบรูปวงรีสามใบที่ซ้อนกันเป็นแถวเดียวบนพื้นหลังสีดำ ต้องแยกได้เป็นสามใบ
+    hsv = np.zeros((height, width, 3), dtype=np.uint8)
+    hsv[...] = (0, 0, 10)
+    leaf = np.zeros((height, width), dtype=np.uint8)
+    axes = (round(width / 6), round(height / 4))
+    for i in range(3):
+        center = (round(width * 0.2 + i * (2 * axes[0] - width / 32)), height // 2)
+        cv2.ellipse(leaf, center, axes, 0, 0, 360, 255, -1)
+    hsv[leaf > 0] = (60, 200, 150)
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2RGB)
+
+
+def reference_band_percentages(img_rgb, mask=None):
+    # การคำนวณแบบเดิม (cv2.inRange ทีละแถบ) ใช้เป็นค่าอ้างอิงของทุกเส้นทางที่ถูกปรับให้เร็วขึ้น
+    img_hsv = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2HSV)
+    selected = np.ones(img_hsv.shape[:2], dtype=bool) if mask is None else mask > 0
+    total = max(int(selected.sum()), 1)
+    return np.array([np.sum((cv2.inRange(img_hsv, np.array(lower), np.array(upper)) > 0) & selected) / total * 100
+                     for _, lower, upper in BANDS])
+
+
+def reference_masks(img_hsv):
+    # การแยกแถบสีแบบเดิม: cv2.inRange ทีละแถบ แล้วนับด้วย np.sum(mask > 0) คืน (mask ของแต่ละแถบ, เปอร์เซ็นต์)
+    masks = [cv2.inRange(img_hsv, np.array(lower), np.array(upper)) for _, lower, upper in BANDS]
+    total = img_hsv.shape[0] * img_hsv.shape[1]
+    return masks, [np.sum(mask > 0) / total * 100 for mask in masks]
+
+
+def reference_highlights(img_rgb, masks):
+    # ภาพเฉพาะแถบแบบเดิม: bitwise_and ที่ความละเอียดเต็มทีละแถบ แล้วย่อเป็นกว้าง 200 ด้วย PIL ตอนแสดงผล
+    highlights = [cv2.bitwise_and(img_rgb, img_rgb, mask=mask) for mask in masks]
+    return [Image.fromarray(highlight).resize((200, int(200 * highlight.shape[0] / highlight.shape[1])))
+            for highlight in highlights]
+
+
+def reference_analyze_leaf(img_rgb):
+    # analyze_leaf แบบเดิม: HSV, inRange ทีละแถบ และภาพเฉพาะแถบทั้งเจ็ดที่ความละเอียดเต็ม
+    masks, pcts = reference_masks(cv2.cvtColor(img_rgb, cv2.COLOR_RGB2HSV))
+    return [cv2.bitwise_and(img_rgb, img_rgb, mask=mask) for mask in masks], pcts
+
+
+def reference_diagnosis(brown, yellow, purple, edge_brown, gray, pale_yellow, dark_brown):
+    # เงื่อนไขแบบ if ต่อกันก่อนย้ายไปเป็นตาราง leaf_rules.RULES คืน (ชื่อการวินิจฉัยตามลำดับที่แสดง, สถานะ pH)
+    names = [name for name, hit in (
+        ("โรคใบไหม้", brown > 5.0), ("โรคราแป้ง", gray > 3.0), ("โรคจุดใบ/เน่า", dark_brown > 4.0),
+        ("ขาดไนโตรเจน (N)", yellow > 10.0), ("ขาดฟอสฟอรัส (P)", purple > 5.0), ("ขาดโพแทสเซียม (K)", edge_brown > 4.0),
+        ("ขาดแคลเซียม (Ca)", gray > 3.0 and brown < 5.0), ("ขาดแมกนีเซียม (Mg)", pale_yellow > 5.0),
+        ("ขาดกำมะถัน (S)", dark_brown > 4.0 and yellow < 10.0),
+        ("ขาดเหล็ก (Fe)", pale_yellow > 5.0 and yellow < 10.0), ("ขาดสังกะสี (Zn)", dark_brown > 4.0 and edge_brown < 4.0),
+        ("ขาดทองแดง (Cu)", brown > 5.0 and purple > 5.0),
+    ) if hit]
+    if yellow > 10 or pale_yellow > 10:
+        ph_status = "ดินอาจเป็นกรดสูง (pH < 6)"
+    elif purple > 5:
+        ph_status = "ดินอาจเป็นด่างสูง (pH > 7.5)"
+    else:
+        ph_status = "ค่า pH อยู่ในช่วงปกติ (6-7.5)"
+    return names, ph_status
+
+
+def correctness_checks(width, height, max_side, tolerance):
+    # ตรวจทุกเส้นทางที่ถูกปรับให้เร็วขึ้นกับการคำนวณแบบเดิม คืน (ความคลาดเคลื่อนของแต่ละการตรวจ, รายการที่ไม่ผ่าน)
+    # เปอร์เซ็นต์เทียบด้วย tolerance (จุดเปอร์เซ็นต์) ส่วน *_mismatches ต้องเป็นศูนย์
+    img_rgb, expected = synthetic_leaf(width, height)
+    reference = reference_band_percentages(img_rgb)
+    expected = np.array([expected[name] for name in BAND_NAMES])
+    # ภาพสังเคราะห์ไม่มีพื้นหลัง จึงปิดการแยกใบเพื่อเทียบกับค่าที่คาดหวังของทั้งภาพ
+    full = analyze_leaf(img_rgb, None, segment=False)
+    downscaled = analyze_leaf(img_rgb, max_side, segment=False)
+    checks = {
+        "expected_vs_reference": float(np.abs(reference - expected).max()),
+        "full_vs_reference": float(np.abs(np.array(list(full.band_pcts.values())) - reference).max()),
+        "downscaled_vs_reference": float(np.abs(np.array(list(downscaled.band_pcts.values())) - reference).max()),
+    }
+
+    # วิเคราะห์ทีละ tile (ขนาด tile ไม่ลงตัวกับภาพ) ต้องได้ผลเท่ากับการวิเคราะห์ทั้งภาพที่ความละเอียดเต็ม
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "leaf.png")
+        Image.fromarray(img_rgb).save(path)
+        tiled = analyze_tiled(path, tile_size=max(64, width // 3 + 7))
+    checks["tiled_vs_reference"] = float(np.abs(np.array(list(tiled.band_pcts.values())) - reference).max())
+
+    # การแยกใบต้องได้เปอร์เซ็นต์ใกล้กับการนับภายในใบจริง ทั้งใบปกติและใบที่มีแผลบนพื้นหลังหลายแบบ
+    # (พื้นหลังที่มีสีของแถบต้องไม่ถูกนับเป็นใบ) และภาพระยะใกล้ที่ขอบไหม้แตะขอบภาพต้องวิเคราะห์ทั้งภาพ
+    # การประเมินใหม่จาก histogram HSV ด้วยตาราง SAT ต้องได้เปอร์เซ็นต์เดียวกับ analyze_leaf ภายใน mask ของใบ
+    segment_checks = {}
+    for background in SCENE_BACKGROUNDS:
+        lesions = (None, "spot", "margin") if background in MARGIN_LESION_BACKGROUNDS else (None, "spot")
+        for lesion in lesions:
+            scene_rgb, leaf = synthetic_scene(width, height, background, lesion)
+            segmented = analyze_leaf(scene_rgb, max_side, segment=True, keep_hsv=True)
+            segment_checks[f"scene_{background}_{lesion or 'healthy'}"] = float(np.abs(
+                np.array(list(segmented.band_pcts.values())) - reference_band_percentages(scene_rgb, leaf)).max())
+    sat_pcts, _, _, _ = rescore(summed_area_table(result_histogram(segmented)))
+    checks["sat_rescore_masked"] = float(np.abs(sat_pcts[0] - np.array(list(segmented.band_pcts.values()))).max())
+    closeup_rgb, expected_brown = synthetic_closeup(width, height)
+    segment_checks["closeup_edge_lesion"] = abs(analyze_leaf(closeup_rgb, max_side, segment=True).band_pcts["brown"]
+                                                - expected_brown)
+    sat_pcts, _, _, _ = rescore(summed_area_table(result_histogram(full)))
+    checks["sat_rescore_full"] = float(np.abs(sat_pcts[0] - reference).max())
+
+    # วิเคราะห์ทีละใบ: แต่ละใบต้องมีอาการของแถบสีของใบนั้น 30% (เรียงใบจากซ้ายไปขวา) และใบที่ซ้อนกันต้องแยกเป็นสามใบ
+    leaves = analyze_leaves(synthetic_leaves(width, height), max_side)
+    order = np.argsort(leaves.bboxes[:, 0])
+    symptoms = [BAND_NAMES.index(name) for name in ("brown", "yellow", "purple")]
+    segment_checks["per_leaf_vs_expected"] = float(max(
+        (abs(leaves.band_pcts[leaf, band] - 30) for leaf, band in zip(order, symptoms)), default=30.0))
+    touching = analyze_leaves(synthetic_touching_leaves(width, height), max_side)
+
+    # ตารางกฎต้องให้ผลเหมือนเงื่อนไขแบบเดิมทุกกรณี รวมค่าที่เท่ากับเกณฑ์พอดี (ปัดเป็นขั้น 0.5)
+    grid = np.round(np.random.default_rng(0).uniform(0, 15, (2000, len(BAND_NAMES))) * 2) / 2
+    statuses = ph_statuses(grid)
+    rule_mismatches = 0
+    for row, ph_status in zip(grid.tolist(), statuses):
+        names = [issue["name"] for issues in disease_diagnosis(*row).values() for issue in issues]
+        rule_mismatches += (names, ph_status) != reference_diagnosis(*row)
+
+    failures = [f"{name}: {error:.4f} > {tolerance}" for name, error in checks.items() if error > tolerance]
+    failures += [f"{name}: {error:.4f} > {SEGMENT_TOLERANCE}" for name, error in segment_checks.items()
+                 if error > SEGMENT_TOLERANCE]
+    for name, count in (("leaf_count", len(leaves.areas)), ("touching_leaf_count", len(touching.areas))):
+        if count != 3:
+            failures.append(f"{name}: {count} != 3")
+    if rule_mismatches:
+        failures.append(f"rules_vs_if_chain_mismatches: {rule_mismatches}")
+    checks.update(segment_checks, leaf_count=len(leaves.areas), touching_leaf_count=len(touching.areas),
+                  rules_vs_if_chain_mismatches=rule_mismatches)
+    return checks, failures
+
+
+def _time(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples, result
+
+
+def _summary(samples, megapixels):
+    p50 = float(np.percentile(samples, 50))
+    return {
+        "p50_ms": p50,
+        "p99_ms": float(np.percentile(samples, 99)),
+        "mp_per_s": megapixels / (p50 / 1000) if p50 > 0 else None,
+    }
+
+
+def bench_resolution(width, height, repeat, max_side, tolerance):
+    img_rgb, _ = synthetic_leaf(width, height)
+    megapixels = width * height / 1e6
+    buffer = io.BytesIO()
+    Image.fromarray(img_rgb).save(buffer, format="JPEG", quality=95)
+    jpeg_bytes = buffer.getvalue()
+
+    timings = {}
+    samples, _ = _time(lambda: decode_image(io.BytesIO(jpeg_bytes), max_side), repeat)
+    timings["decode"] = samples
+    timings["segment"], _ = _time(lambda: leaf_roi(img_rgb), repeat)
+    samples, img_hsv = _time(lambda: cv2.cvtColor(img_rgb, cv2.COLOR_RGB2HSV), repeat)
+    timings["hsv"] = samples
+    samples, (codes, counts) = _time(lambda: classify_bands(img_hsv), repeat)
+    timings["masking"] = samples
+
+    def render_highlights():
+        preview_rgb = resize_to_width(img_rgb, 300)
+        preview_codes = resize_to_width(codes, 300, interpolation=cv2.INTER_NEAREST)
+        overlay_bands(preview_rgb, preview_codes)
+        return [band_preview(preview_rgb, preview_codes, i) for i in range(len(BAND_NAMES))]
+
+    timings["highlight"], _ = _time(render_highlights, repeat)
+    timings["histogram"], _ = _time(lambda: rgb_histogram(img_rgb), repeat)
+    pcts = (counts / codes.size * 100).tolist()
+    timings["diagnosis"], _ = _time(lambda: disease_diagnosis(*pcts), repeat)
+    timings["analyze_leaf"], _ = _time(lambda: analyze_leaf(img_rgb, max_side, segment=False), repeat)
+    # เส้นทางที่ใช้งานจริง: แยกใบจากพื้นหลังด้วย ตั้งแต่ภาพ RGB จนได้ผลลัพธ์
+    scene_rgb, _ = synthetic_scene(width, height, "soil", "spot")
+    timings["analyze_leaf_segmented"], _ = _time(lambda: analyze_leaf(scene_rgb, max_side, segment=True), repeat)
+
+    # การคำนวณแบบเดิมบนภาพเดียวกัน เพื่อรายงานว่าแต่ละขั้นตอนเร็วขึ้นกี่เท่า
+    reference = {}
+    samples, (masks, reference_pcts) = _time(lambda: reference_masks(img_hsv), repeat)
+    reference["masking"] = samples
+    reference["highlight"], _ = _time(lambda: reference_highlights(img_rgb, masks), repeat)
+    reference["diagnosis"], _ = _time(lambda: reference_diagnosis(*reference_pcts), repeat)
+    reference["analyze_leaf"], _ = _time(lambda: reference_analyze_leaf(img_rgb), repeat)
+    reference = {stage: _summary(samples, megapixels) for stage, samples in reference.items()}
+    stages = {stage: _summary(timings[stage], megapixels) for stage in STAGES}
+    speedup = {stage: reference[base]["p50_ms"] / stages[stage]["p50_ms"]
+               for stage, base in REFERENCE_STAGES.items() if stages[stage]["p50_ms"] > 0}
+    checks, failures = correctness_checks(width, height, max_side, tolerance)
+
+    return {
+        "width": width,
+        "height": height,
+        "megapixels": megapixels,
+        "stages": stages,
+        "reference": reference,
+        "speedup": speedup,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "max_abs_error_pct": checks,
+        "failures": failures,
+    }
+
+
+def compare_baseline(report, baseline, max_regression):
+    regressions = []
+    for name, current in report["resolutions"].items():
+        previous = baseline.get("resolutions", {}).get(name)
+        if previous is None:
+            continue
+        for stage, stats in current["stages"].items():
+            before = previous["stages"].get(stage, {}).get("p50_ms")
+            if before and stats["p50_ms"] > before * (1 + max_regression):
+                regressions.append(f"{name}/{stage}: p50 {stats['p50_ms']:.2f} ms > baseline {before:.2f} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="วัดประสิทธิภาพและตรวจความถูกต้องของขั้นตอนวิเคราะห์ภาพใบพืช")
+    parser.add_argument("--sizes", nargs="+", choices=list(RESOLUTIONS), default=list(RESOLUTIONS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-side", type=int, default=1024, help="ความละเอียดของโหมดย่อภาพ (0 = ความละเอียดเต็ม)")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="ความคลาดเคลื่อนสูงสุดที่ยอมรับ (จุดเปอร์เซ็นต์)")
+    parser.add_argument("-o", "--output", help="บันทึกผลเป็น JSON (ค่าเริ่มต้น: stdout)")
+    parser.add_argument("--baseline", help="ไฟล์ JSON ผลอ้างอิง: ล้มเหลวเมื่อ p50 ช้ากว่าเกิน --max-regression")
+    parser.add_argument("--max-regression", type=float, default=0.25)
+    parser.add_argument("--update-baseline", action="store_true", help="เขียนผลครั้งนี้ทับไฟล์ --baseline")
+    args = parser.parse_args(argv)
+
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "machine": platform.machine(),
+        "repeat": args.repeat,
+        "max_side": args.max_side or None,
+        "resolutions": {},
+    }
+    for name in sorted(args.sizes, key=lambda size: RESOLUTIONS[size][0] * RESOLUTIONS[size][1]):
+        width, height = RESOLUTIONS[name]
+        report["resolutions"][name] = bench_resolution(width, height, args.repeat, args.max_side or None, args.tolerance)
+        result = report["resolutions"][name]
+        print(f"{name}: analyze_leaf p50 {result['stages']['analyze_leaf']['p50_ms']:.1f} ms, speedup "
+              + ", ".join(f"{stage} x{ratio:.2f}" for stage, ratio in result["speedup"].items()), file=sys.stderr)
+
+    failures = [f"{name}/{failure}" for name, result in report["resolutions"].items() for failure in result["failures"]]
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    elif args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            failures += compare_baseline(report, json.load(f), args.max_regression)
+    report["failures"] = failures
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if failures:
+        print("BENCHMARK FAILED:\n  " + "\n  ".join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+def test_correctness():
+    # รันด้วย python -m pytest bench_leaf.py: ตรวจความถูกต้องทุกข้อที่ความละเอียดเล็กโดยไม่จับเวลา
+    _, failures = correctness_checks(*RESOLUTIONS["0.3MP"], max_side=DEFAULT_MAX_SIDE, tolerance=0.5)
+    assert not failures, failures
+
+
+if __name__ == "__main__":
+    main()
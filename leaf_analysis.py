@@ -0,0 +1,184 @@
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+from leaf_bands import (BAND_NAMES, DEFAULT_MAX_SIDE, classify_bands, code_bits, count_bands, downscale_max_side,
+                        overlay_bands)
+from leaf_decode import DEFAULT_TILE_SIZE, iter_tiles, raster_size, to_rgb_array
+from leaf_rules import build_diagnoses, evaluate_rules, ph_statuses
+from leaf_segment import leaf_mask, leaf_roi, split_leaves
+
+
+@dataclass(slots=True)
+class AnalysisResult:
+    # bitmask ของแถบสีต่อพิกเซล (1 บิตต่อแถบ ลำดับตาม BAND_NAMES) ที่ความละเอียดของภาพทำงาน
+    band_codes: np.ndarray
+    img_rgb: np.ndarray
+    # ชื่อแถบสี -> เปอร์เซ็นต์พิกเซล ลำดับตาม BAND_NAMES
+    band_pcts: dict
+    disease_prob: float
+    ph_status: str
+    # mask ของใบ (0/255) ขนาดเท่า img_rgb เมื่อแยกใบจากพื้นหลัง, None = ใช้ทั้งภาพ
+    leaf_mask: np.ndarray = None
+    # สัดส่วนพื้นที่ใบต่อพื้นที่ภาพทั้งหมด
+    leaf_fraction: float = 1.0
+    # ภาพ HSV ที่ใช้จำแนกแถบสี เก็บไว้เฉพาะเมื่อเรียก analyze_leaf(keep_hsv=True) เช่น ตอนสร้าง histogram ปรับเกณฑ์
+    img_hsv: np.ndarray = None
+
+    def to_dict(self):
+        return {"band_pcts": dict(self.band_pcts), "disease_prob": self.disease_prob, "ph_status": self.ph_status,
+                "leaf_fraction": self.leaf_fraction}
+
+
+def summarize_counts(band_counts, total_pixels):
+    # แปลงจำนวนพิกเซลของแต่ละแถบเป็นเปอร์เซ็นต์ พร้อมโอกาสเกิดปัญหาและสถานะ pH
+    pcts = (np.asarray(band_counts) / max(int(total_pixels), 1) * 100).tolist()
+    disease_prob = sum(pcts) / len(pcts)
+    ph_status = ph_statuses([pcts])[0]
+    return dict(zip(BAND_NAMES, pcts)), disease_prob, ph_status
+
+
+def analyze_leaf(image, max_side=DEFAULT_MAX_SIDE, segment=True, keep_hsv=False):
+    img_rgb = downscale_max_side(to_rgb_array(image), max_side)
+    
+    # แยกใบจากพื้นหลัง แล้ววิเคราะห์เฉพาะกรอบของใบ เปอร์เซ็นต์คิดจากพื้นที่ใบเท่านั้น
+    roi = leaf_roi(img_rgb) if segment else None
+    mask, leaf_fraction = None, 1.0
+    if roi is not None:
+        bbox, mask, leaf_fraction = roi
+        img_rgb = img_rgb[bbox]
+    img_hsv = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2HSV)
+    
+    # จำแนกทุกแถบสีเป็น bitmask ต่อพิกเซล (inRange ครั้งเดียวต่อช่วงสีที่ไม่ซ้ำ) แทนมาสก์เต็มขนาดแยกทีละแถบ
+    band_codes, band_counts = classify_bands(img_hsv)
+    total_pixels = band_codes.size
+    if mask is not None:
+        band_codes[mask == 0] = 0
+        band_counts = count_bands(band_codes)
+        total_pixels = cv2.countNonZero(mask)
+    
+    # ส่งคืน bitmask ของแถบสี (1 ไบต์ต่อพิกเซล) แทนสำเนาภาพ RGB เต็มขนาดของแต่ละแถบ
+    # ภาพแสดงผลของแต่ละแถบให้สร้างจากภาพขนาดย่อด้วย leaf_bands.band_preview / overlay_bands
+    return AnalysisResult(band_codes, img_rgb, *summarize_counts(band_counts, total_pixels), mask, leaf_fraction,
+                          img_hsv if keep_hsv else None)
+
+
+@dataclass(slots=True)
+class LeafComponents:
+    # ผลวิเคราะห์แยกทีละใบ: ใบที่ i (เริ่มจาก 0) มีค่า i + 1 ใน labels, 0 = พื้นหลัง
+    labels: np.ndarray
+    band_codes: np.ndarray
+    img_rgb: np.ndarray
+    # (x, y, กว้าง, สูง) ของแต่ละใบ
+    bboxes: np.ndarray
+    areas: np.ndarray
+    # เมทริกซ์ จำนวนใบ x 7 ลำดับคอลัมน์ตาม BAND_NAMES
+    band_pcts: np.ndarray
+    disease_prob: np.ndarray
+    ph_status: list
+    fired: np.ndarray
+
+    def rows(self):
+        rows = []
+        for i in range(len(self.areas)):
+            row = {"leaf": i + 1, "area_px": int(self.areas[i])}
+            row.update((f"{name}_pct", float(pct)) for name, pct in zip(BAND_NAMES, self.band_pcts[i]))
+            row["disease_prob"] = float(self.disease_prob[i])
+            row["ph_status"] = self.ph_status[i]
+            row["diagnoses"] = build_diagnoses(self.fired[i])
+            rows.append(row)
+        return rows
+
+
+def analyze_leaves(image, max_side=DEFAULT_MAX_SIDE, min_leaf_fraction=0.002):
+    # หาใบแต่ละใบในภาพที่มีหลายใบ (แยกใบที่ติดกันด้วย split_leaves) แล้วคำนวณทุกแถบของทุกใบในรอบเดียว:
+    # bincount ของ (ป้ายใบ x 256 + bitmask) ให้ histogram ของ bitmask ต่อใบ แล้วคูณกับเมทริกซ์บิตของแถบ
+    # พื้นที่ใบและตัวหารของเปอร์เซ็นต์นับจาก mask ที่ไม่ได้ขยายขอบ
+    img_rgb = downscale_max_side(to_rgb_array(image), max_side)
+    small = leaf_mask(img_rgb)
+    n, small_labels = split_leaves(small)
+    labels = cv2.resize(small_labels, (img_rgb.shape[1], img_rgb.shape[0]), interpolation=cv2.INTER_NEAREST)
+    
+    areas = np.bincount(labels.ravel(), minlength=n + 1)
+    keep = np.flatnonzero(areas[1:] >= min_leaf_fraction * labels.size) + 1
+    relabel = np.zeros(n + 1, dtype=np.int32)
+    relabel[keep] = np.arange(1, len(keep) + 1)
+    labels = relabel[labels]
+    areas = areas[keep]
+    # กรอบของแต่ละใบจากป้ายขนาดภาพย่อ แปลงเป็นพิกัดของภาพทำงาน
+    sx, sy = img_rgb.shape[1] / small.shape[1], img_rgb.shape[0] / small.shape[0]
+    bboxes = np.array([cv2.boundingRect((small_labels == k).astype(np.uint8)) for k in keep],
+                      dtype=np.float64).reshape(-1, 4) * (sx, sy, sx, sy)
+    
+    band_codes, _ = classify_bands(cv2.cvtColor(img_rgb, cv2.COLOR_RGB2HSV))
+    band_codes[labels == 0] = 0
+    code_hist = np.bincount((labels.astype(np.int64) * 256 + band_codes).ravel(),
+                            minlength=(len(keep) + 1) * 256).reshape(-1, 256)[1:]
+    band_pcts = (code_hist @ code_bits(len(BAND_NAMES))) / np.maximum(areas, 1)[:, None] * 100
+    
+    fired, _ = evaluate_rules(band_pcts)
+    return LeafComponents(labels, band_codes, img_rgb, bboxes.round().astype(np.int32), areas, band_pcts,
+                          band_pcts.mean(axis=1), ph_statuses(band_pcts), fired)
+
+
+def leaves_overlay(leaves, width=None):
+    # ภาพซ้อนสีแถบที่ตรวจพบพร้อมกรอบและหมายเลขของแต่ละใบ ย่อเป็นความกว้าง width ก่อนวาดถ้าระบุ
+    img_rgb, codes, bboxes = leaves.img_rgb, leaves.band_codes, leaves.bboxes.astype(np.float64)
+    if width and img_rgb.shape[1] > width:
+        scale = width / img_rgb.shape[1]
+        size = (width, max(1, round(img_rgb.shape[0] * scale)))
+        img_rgb = cv2.resize(img_rgb, size, interpolation=cv2.INTER_AREA)
+        codes = cv2.resize(codes, size, interpolation=cv2.INTER_NEAREST)
+        bboxes = bboxes * scale
+    overlay = np.ascontiguousarray(overlay_bands(img_rgb, codes))
+    for i, (x, y, w, h) in enumerate(bboxes.round().astype(int)):
+        cv2.rectangle(overlay, (x, y), (x + w, y + h), (0, 255, 0), 1)
+        cv2.putText(overlay, str(i + 1), (x + 2, y + 14), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+    return overlay
+
+
+def analyze_tiled(path, tile_size=DEFAULT_TILE_SIZE, preview_side=DEFAULT_MAX_SIDE):
+    # วิเคราะห์ภาพขนาดใหญ่มาก (เช่น orthomosaic จากโดรน) ทีละ tile และสะสมจำนวนพิกเซลของแต่ละแถบ
+    # เปอร์เซ็นต์คำนวณจากความละเอียดเต็ม ส่วน img_rgb/band_codes ในผลลัพธ์เป็นภาพย่อขนาด preview_side
+    width, height = raster_size(path)
+    scale = min(1.0, preview_side / max(width, height))
+    preview = np.zeros((max(1, round(height * scale)), max(1, round(width * scale)), 3), dtype=np.uint8)
+    band_counts = np.zeros(len(BAND_NAMES), dtype=np.int64)
+    total_pixels = 0
+    for y, x, tile, valid in iter_tiles(path, tile_size):
+        codes, counts = classify_bands(cv2.cvtColor(tile, cv2.COLOR_RGB2HSV))
+        if valid is None:
+            band_counts += counts
+            total_pixels += codes.size
+        else:
+            band_counts += count_bands(codes[valid])
+            total_pixels += int(valid.sum())
+        
+        y0, x0 = round(y * scale), round(x * scale)
+        y1 = min(preview.shape[0], round((y + tile.shape[0]) * scale))
+        x1 = min(preview.shape[1], round((x + tile.shape[1]) * scale))
+        if y1 > y0 and x1 > x0:
+            preview[y0:y1, x0:x1] = cv2.resize(tile, (x1 - x0, y1 - y0), interpolation=cv2.INTER_AREA)
+    
+    band_codes, _ = classify_bands(cv2.cvtColor(preview, cv2.COLOR_RGB2HSV))
+    return AnalysisResult(band_codes, preview, *summarize_counts(band_counts, total_pixels))
+
+
+def rgb_histogram(img_rgb, mask=None):
+    # histogram ของทั้งสามช่องสีเป็นจำนวนเต็มขนาด 3x256 (แดง, เขียว, น้ำเงิน) นับเฉพาะพิกเซลใน mask ถ้าระบุ
+    return np.stack([cv2.calcHist([img_rgb], [channel], mask, [256], [0, 256]).ravel()
+                     for channel in range(3)]).astype(np.int64)
+
+
+def disease_diagnosis(brown_pct, yellow_pct, purple_pct, edge_brown_pct, gray_pct, pale_yellow_pct, dark_brown_pct):
+    # เกณฑ์การวินิจฉัยอยู่ในตารางกฎ leaf_rules.RULES ใช้ evaluate_rules โดยตรงเมื่อต้องประเมินหลายภาพพร้อมกัน
+    fired, _ = evaluate_rules([[brown_pct, yellow_pct, purple_pct, edge_brown_pct, gray_pct, pale_yellow_pct,
+                                dark_brown_pct]])
+    return build_diagnoses(fired[0])
+
+
+def diagnose(result):
+    # วินิจฉัยจาก AnalysisResult (หรือ dict ชื่อแถบ -> เปอร์เซ็นต์) โดยไม่ต้องเรียงพารามิเตอร์เอง
+    band_pcts = result.band_pcts if isinstance(result, AnalysisResult) else result
+    return disease_diagnosis(*(band_pcts[name] for name in BAND_NAMES))
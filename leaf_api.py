@@ -0,0 +1,165 @@
+import argparse
+import io
+import json
+import traceback
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image
+
+from leaf_analysis import analyze_leaf, diagnose
+from leaf_bands import DEFAULT_MAX_SIDE, check_max_side
+from leaf_decode import decode_image
+from leaf_metrics import METRICS
+
+# ขนาดสูงสุดของ request body (ไบต์)
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+
+class BadRequest(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def score_image(image_bytes, max_side=DEFAULT_MAX_SIDE, segment=True):
+    with METRICS.stage("decode"):
+        img_rgb = decode_image(io.BytesIO(image_bytes), max_side)
+    with METRICS.stage("analysis"):
+        result = analyze_leaf(img_rgb, max_side, segment)
+    with METRICS.stage("diagnosis"):
+        scored = result.to_dict()
+        scored["diagnoses"] = diagnose(result)
+    return scored
+
+
+def iter_multipart(content_type, body):
+    # แยกไฟล์ทุกไฟล์จาก multipart/form-data คืน (ชื่อไฟล์, ไบต์ของภาพ)
+    message = BytesParser(policy=HTTP).parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+    if not message.is_multipart():
+        raise BadRequest("multipart body ไม่ถูกต้อง")
+    for part in message.iter_parts():
+        payload = part.get_payload(decode=True)
+        if payload:
+            yield part.get_filename() or part.get_param("name", header="content-disposition"), payload
+
+
+class LeafAPIHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 เพื่อรองรับ keep-alive: ไคลเอนต์ส่งหลาย request ผ่านการเชื่อมต่อเดียวได้
+    protocol_version = "HTTP/1.1"
+    server_version = "LeafAPI/1.0"
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif path == "/metrics":
+            body = METRICS.prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != "/analyze":
+            self._drain_body()
+            self._send_json(404, {"error": "not found"})
+            return
+        # อ่าน body ให้หมดก่อนตรวจพารามิเตอร์ ไม่เช่นนั้นไบต์ของภาพจะค้างอยู่บนการเชื่อมต่อ keep-alive
+        # และถูกอ่านเป็น request ถัดไป ถ้าออกจากที่นี่โดยยังอ่าน body ไม่ครบ ต้องปิดการเชื่อมต่อ
+        body = None
+        try:
+            body = self._read_body()
+            params = parse_qs(url.query)
+            max_side = check_max_side(int(params.get("max_side", [DEFAULT_MAX_SIDE])[0]))
+            segment = params.get("segment", ["1"])[0] not in ("0", "false")
+            content_type = self.headers.get("Content-Type", "")
+            if content_type.startswith("multipart/form-data"):
+                response = [dict(filename=name, **self._score(data, max_side, segment))
+                            for name, data in iter_multipart(content_type, body)]
+            else:
+                response = self._score(body, max_side, segment)
+        except BadRequest as exc:
+            self._send_error_json(exc.status, str(exc), body)
+            return
+        except ValueError as exc:
+            self._send_error_json(400, str(exc), body)
+            return
+        except Exception:
+            traceback.print_exc()
+            self._send_error_json(500, "internal server error", body)
+            return
+        self._send_json(200, response)
+
+    def _score(self, data, max_side, segment):
+        try:
+            return score_image(data, max_side, segment)
+        except (OSError, Image.DecompressionBombError) as exc:
+            raise BadRequest(f"อ่านไฟล์ภาพไม่ได้: {exc}")
+
+    def _content_length(self):
+        try:
+            return int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            self.close_connection = True
+            raise BadRequest("Content-Length ไม่ถูกต้อง")
+
+    def _read_body(self):
+        length = self._content_length()
+        if length <= 0:
+            raise BadRequest("ต้องส่งไฟล์ภาพใน request body (Content-Length)")
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            raise BadRequest("ไฟล์มีขนาดใหญ่เกินกำหนด", status=413)
+        return self.rfile.read(length)
+
+    def _drain_body(self):
+        try:
+            length = self._content_length()
+        except BadRequest:
+            return
+        if 0 < length <= MAX_BODY_BYTES:
+            self.rfile.read(length)
+        elif length:
+            self.close_connection = True
+
+    def _send_error_json(self, status, message, body):
+        if body is None:
+            self.close_connection = True
+        self._send_json(status, {"error": message})
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP API สำหรับวิเคราะห์ภาพใบพืช")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+
+    server = ThreadingHTTPServer((args.host, args.port), LeafAPIHandler)
+    print(f"Leaf API กำลังทำงานที่ http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import argparse
+import hashlib
+from functools import lru_cache
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# ตารางช่วงสี HSV ของแต่ละแถบสี: (ชื่อ, ค่าต่ำสุด H/S/V, ค่าสูงสุด H/S/V)
+# ลำดับในตารางคือลำดับบิตใน bitmask และลำดับค่าเปอร์เซ็นต์ที่ analyze_leaf ส่งคืน
+BANDS = (
+    ("brown", (10, 50, 50), (30, 255, 255)),
+    ("yellow", (20, 40, 100), (40, 255, 255)),
+    ("purple", (120, 40, 50), (160, 255, 255)),
+    ("edge_brown", (5, 50, 20), (20, 255, 100)),
+    ("gray", (0, 0, 150), (180, 30, 255)),
+    ("pale_yellow", (25, 20, 150), (35, 100, 255)),
+    ("dark_brown", (5, 50, 20), (20, 255, 100)),
+)
+BAND_NAMES = tuple(name for name, _, _ in BANDS)
+# สีที่ใช้แสดงแต่ละแถบบนภาพซ้อนทับ (RGB) ลำดับตรงกับ BANDS
+BAND_COLORS = (
+    (139, 69, 19),
+    (255, 215, 0),
+    (148, 0, 211),
+    (255, 99, 71),
+    (200, 200, 200),
+    (240, 230, 140),
+    (60, 30, 10),
+)
+# เวอร์ชันของตารางแถบสี ใช้เป็นส่วนหนึ่งของคีย์แคช เปลี่ยนอัตโนมัติเมื่อแก้ไขช่วงสี
+BAND_TABLE_VERSION = hashlib.sha1(repr(BANDS).encode()).hexdigest()[:12]
+
+# ด้านยาวสุดของภาพทำงานในโหมดย่อภาพก่อนวิเคราะห์ (None = ความละเอียดเต็ม)
+DEFAULT_MAX_SIDE = 1024
+# ด้านยาวสุดที่เล็กที่สุดที่ยอมรับ ภาพที่เล็กกว่านี้เหลือไม่กี่พิกเซลและให้ผลที่ไม่มีความหมาย
+MIN_MAX_SIDE = 64
+
+
+@lru_cache(maxsize=4)
+def band_ranges(bands=BANDS):
+    # ช่วงสีที่ไม่ซ้ำกันพร้อมบิตของทุกแถบที่ใช้ช่วงนั้น (เช่น edge_brown และ dark_brown ใช้ช่วงเดียวกัน)
+    # คืน tuple ของ (ค่าต่ำสุด, ค่าสูงสุด, bitmask, ลำดับแถบ)
+    if len(bands) > 8:
+        raise ValueError("รองรับได้สูงสุด 8 แถบสีต่อ bitmask แบบ uint8")
+    groups = {}
+    for bit, (_, lower, upper) in enumerate(bands):
+        groups.setdefault((tuple(lower), tuple(upper)), []).append(bit)
+    return tuple((np.array(lower), np.array(upper), sum(1 << bit for bit in bits), bits)
+                 for (lower, upper), bits in groups.items())
+
+
+def classify_bands(img_hsv, bands=BANDS):
+    # ติดป้ายทุกพิกเซลเป็น bitmask ของแถบสี: cv2.inRange หนึ่งครั้งต่อช่วงสีที่ไม่ซ้ำ แล้ว OR บิตลงใน bitmask
+    # จำนวนพิกเซลของแต่ละแถบได้จาก countNonZero ของผล inRange โดยไม่ต้องทำ histogram ของ bitmask
+    codes = np.zeros(img_hsv.shape[:2], dtype=np.uint8)
+    hit = np.empty_like(codes)
+    counts = np.zeros(len(bands), dtype=np.int64)
+    for lower, upper, bitmask, bits in band_ranges(bands):
+        cv2.inRange(img_hsv, lower, upper, dst=hit)
+        counts[bits] = cv2.countNonZero(hit)
+        np.bitwise_and(hit, np.uint8(bitmask), out=hit)
+        cv2.bitwise_or(codes, hit, dst=codes)
+    return codes, counts
+
+
+@lru_cache(maxsize=8)
+def code_bits(n_bands=len(BANDS)):
+    # เมทริกซ์ 256 x n_bands: แถว code มีค่า 1 ในคอลัมน์ของแถบที่บิตนั้นตั้งอยู่
+    bits = (np.arange(256)[:, None] >> np.arange(n_bands)) & 1
+    bits.setflags(write=False)
+    return bits
+
+
+def count_bands(codes, n_bands=len(BANDS)):
+    return np.bincount(codes.ravel(), minlength=256) @ code_bits(n_bands)
+
+
+def band_mask(codes, index):
+    # mask ที่ไม่เป็นศูนย์ตรงพิกเซลของแถบสี index ใช้กับ cv2.bitwise_and ได้โดยตรง
+    return np.bitwise_and(codes, np.uint8(1 << index))
+
+
+@lru_cache(maxsize=4)
+def code_palette(colors=BAND_COLORS):
+    # สีของแต่ละค่า bitmask: ใช้สีของแถบที่มีลำดับต่ำสุดในพิกเซลนั้น, 0 = ไม่มีแถบใด
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    for code in range(1, 256):
+        bit = (code & -code).bit_length() - 1
+        if bit < len(colors):
+            palette[code] = colors[bit]
+    palette.setflags(write=False)
+    return palette
+
+
+def overlay_bands(img_rgb, codes, alpha=0.5):
+    # ซ้อนสีของแถบที่ตรวจพบลงบนภาพ codes จะถูกปรับขนาดให้เท่าภาพด้วย INTER_NEAREST ถ้าจำเป็น
+    h, w = img_rgb.shape[:2]
+    if codes.shape[:2] != (h, w):
+        codes = cv2.resize(codes, (w, h), interpolation=cv2.INTER_NEAREST)
+    colored = code_palette()[codes]
+    blended = cv2.addWeighted(img_rgb, 1 - alpha, colored, alpha, 0)
+    return np.where((codes > 0)[..., None], blended, img_rgb)
+
+
+def band_preview(img_rgb, codes, index):
+    # ภาพเฉพาะพิกเซลของแถบสี index (พื้นหลังดำ) สร้างจากภาพขนาดย่อเมื่อต้องแสดงผลเท่านั้น
+    return cv2.bitwise_and(img_rgb, img_rgb, mask=band_mask(codes, index))
+
+
+def downscale_max_side(img, max_side):
+    # ย่อภาพด้วย INTER_AREA ให้ด้านยาวสุดไม่เกิน max_side (ไม่ขยายภาพเล็ก)
+    if not max_side:
+        return img
+    h, w = img.shape[:2]
+    scale = max_side / max(h, w)
+    if scale >= 1:
+        return img
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+
+def check_max_side(max_side):
+    # 0 หรือ None = ความละเอียดเต็ม ค่าติดลบหรือเล็กกว่า MIN_MAX_SIDE ไม่ถูกต้อง
+    if max_side and max_side < MIN_MAX_SIDE:
+        raise ValueError(f"max_side ต้องเป็น 0 (ความละเอียดเต็ม) หรืออย่างน้อย {MIN_MAX_SIDE}")
+    return max_side or None
+
+
+def max_side_arg(text):
+    # type ของ argparse สำหรับ --max-side
+    try:
+        return check_max_side(int(text))
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc))
+
+
+def resize_to_width(img, width, interpolation=cv2.INTER_AREA):
+    h, w = img.shape[:2]
+    return cv2.resize(img, (width, max(1, int(width * h / w))), interpolation=interpolation)
+
+
+def band_percentages(img_rgb, max_side=None):
+    img_hsv = cv2.cvtColor(downscale_max_side(img_rgb, max_side), cv2.COLOR_RGB2HSV)
+    _, counts = classify_bands(img_hsv)
+    return counts / (img_hsv.shape[0] * img_hsv.shape[1]) * 100
+
+
+def downscale_drift(images, max_side=DEFAULT_MAX_SIDE):
+    # ความคลาดเคลื่อนสัมบูรณ์ (หน่วยจุดเปอร์เซ็นต์) ของแต่ละแถบ เทียบกับการวิเคราะห์ที่ความละเอียดเต็ม
+    diffs = np.array([np.abs(band_percentages(img, max_side) - band_percentages(img)) for img in images])
+    return {
+        "mean": dict(zip(BAND_NAMES, diffs.mean(axis=0).tolist())),
+        "max": dict(zip(BAND_NAMES, diffs.max(axis=0).tolist())),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="วัดความคลาดเคลื่อนของเปอร์เซ็นต์แถบสีเมื่อย่อภาพก่อนวิเคราะห์")
+    parser.add_argument("images", nargs="+", help="ภาพอ้างอิง")
+    parser.add_argument("--max-side", type=max_side_arg, default=DEFAULT_MAX_SIDE)
+    args = parser.parse_args(argv)
+
+    images = [np.array(Image.open(path).convert("RGB")) for path in args.images]
+    drift = downscale_drift(images, args.max_side)
+    print(f"{'band':<12} {'mean':>8} {'max':>8}")
+    for name in BAND_NAMES:
+        print(f"{name:<12} {drift['mean'][name]:>8.3f} {drift['max'][name]:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import nullcontext
+
+import numpy as np
+
+from leaf_analysis import analyze_leaf, analyze_tiled
+from leaf_bands import BAND_NAMES, DEFAULT_MAX_SIDE, max_side_arg
+from leaf_decode import decode_image, raster_size
+from leaf_rules import PH_DEFAULT, PH_RULES, RULES, build_diagnoses, evaluate_rules, load_rules, ph_statuses
+
+DEFAULT_RULE_SET = (RULES, PH_RULES, PH_DEFAULT)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp", ".webp")
+PCT_COLUMNS = tuple(f"{name}_pct" for name in BAND_NAMES)
+COLUMNS = ("path",) + PCT_COLUMNS + ("disease_prob", "ph_status", "leaf_fraction", "diagnoses", "error")
+FORMATS = ("csv", "jsonl", "parquet")
+# ภาพที่มีพิกเซลมากกว่านี้วิเคราะห์ทีละ tile ที่ความละเอียดเต็ม (เช่น orthomosaic จากโดรน)
+TILED_MIN_PIXELS = 100_000_000
+
+
+def iter_image_paths(inputs):
+    # รับได้ทั้งโฟลเดอร์ (ค้นทุกโฟลเดอร์ย่อย) และ glob pattern
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield os.path.join(root, name)
+        else:
+            yield from sorted(glob.glob(item, recursive=True))
+
+
+def analyze_path(path, max_side=DEFAULT_MAX_SIDE, segment=True):
+    record = {"path": path}
+    try:
+        width, height = raster_size(path)
+        tiled = width * height >= TILED_MIN_PIXELS
+        if tiled:
+            # ภาพแบบ tile เป็นภาพแปลงทั้งแปลง ไม่ได้แยกใบจากพื้นหลัง (ไม่สนใจ segment) เปอร์เซ็นต์คิดจากทั้งภาพ
+            result = analyze_tiled(path)
+        else:
+            result = analyze_leaf(decode_image(path, max_side), max_side, segment)
+    except Exception as exc:
+        record["error"] = f"{type(exc).__name__}: {exc}"
+        return record
+    record.update((f"{name}_pct", pct) for name, pct in result.band_pcts.items())
+    record["disease_prob"] = result.disease_prob
+    record["leaf_fraction"] = None if tiled else result.leaf_fraction
+    return record
+
+
+def analyze_chunk(paths, max_side=DEFAULT_MAX_SIDE, rule_set=DEFAULT_RULE_SET, segment=True):
+    rules, ph_rules, ph_default = rule_set
+    records = [analyze_path(path, max_side, segment) for path in paths]
+    # ประเมินกฎการวินิจฉัยและ pH ของทั้งชุดในครั้งเดียว
+    scored = [record for record in records if "error" not in record]
+    if scored:
+        band_pcts = np.array([[record[column] for column in PCT_COLUMNS] for record in scored])
+        fired, _ = evaluate_rules(band_pcts, rules)
+        statuses = ph_statuses(band_pcts, ph_rules, ph_default)
+        for record, fired_row, status in zip(scored, fired, statuses):
+            record["ph_status"] = status
+            record["diagnoses"] = build_diagnoses(fired_row, rules)
+    return records
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_batch(paths, max_side=DEFAULT_MAX_SIDE, workers=None, chunk_size=16, rule_set=DEFAULT_RULE_SET,
+              segment=True):
+    # ส่งงานเป็นชุด และจำกัดจำนวนชุดที่ค้างอยู่ เพื่อไม่ให้คิวงานโตตามจำนวนไฟล์ทั้งหมด
+    workers = workers or os.cpu_count() or 1
+    max_pending = workers * 2
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for chunk in _chunks(paths, chunk_size):
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+            pending.add(pool.submit(analyze_chunk, chunk, max_side, rule_set, segment))
+        for future in pending:
+            yield from future.result()
+
+
+def diagnosis_names(diagnoses):
+    return "; ".join(issue["name"] for issues in diagnoses.values() for issue in issues)
+
+
+def _flat_record(record):
+    row = dict(record)
+    if "diagnoses" in row:
+        row["diagnoses"] = diagnosis_names(row["diagnoses"])
+    return row
+
+
+def write_records(records, output, fmt):
+    count = 0
+    if fmt == "parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("การเขียนไฟล์ Parquet ต้องติดตั้ง pyarrow ก่อน (pip install pyarrow)")
+        rows = [_flat_record(record) for record in records]
+        columns = {column: [row.get(column) for row in rows] for column in COLUMNS}
+        pq.write_table(pa.table(columns), output)
+        return len(rows)
+
+    out = nullcontext(sys.stdout) if output == "-" else open(output, "w", newline="", encoding="utf-8")
+    with out as f:
+        if fmt == "csv":
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            for record in records:
+                writer.writerow(_flat_record(record))
+                count += 1
+        else:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="leaf-analyze", description="วิเคราะห์ภาพใบพืชทั้งโฟลเดอร์โดยไม่ต้องเปิดหน้าเว็บ")
+    parser.add_argument("inputs", nargs="+", help="โฟลเดอร์หรือ glob pattern ของภาพ")
+    parser.add_argument("-o", "--output", default="-", help="ไฟล์ผลลัพธ์ (ค่าเริ่มต้น: stdout)")
+    parser.add_argument("-f", "--format", choices=FORMATS, help="รูปแบบผลลัพธ์ (เดาจากนามสกุลไฟล์ถ้าไม่ระบุ)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="จำนวนโปรเซส (ค่าเริ่มต้น: จำนวน CPU)")
+    parser.add_argument("--chunk-size", type=int, default=16, help="จำนวนภาพต่อชุดงานที่ส่งให้แต่ละโปรเซส")
+    parser.add_argument("--max-side", type=max_side_arg, default=DEFAULT_MAX_SIDE,
+                        help="ด้านยาวสุดของภาพที่ใช้วิเคราะห์ (0 = ความละเอียดเต็ม)")
+    parser.add_argument("--no-segment", dest="segment", action="store_false",
+                        help="คิดเปอร์เซ็นต์จากทั้งภาพ ไม่แยกใบออกจากพื้นหลัง")
+    parser.add_argument("--rules", help="ไฟล์ JSON ของตารางกฎการวินิจฉัย (ดู python leaf_rules.py --dump)")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or os.path.splitext(args.output)[1].lstrip(".").lower() or "jsonl"
+    if fmt not in FORMATS:
+        parser.error(f"ไม่รู้จักรูปแบบผลลัพธ์ {fmt!r}")
+    if fmt == "parquet" and args.output == "-":
+        parser.error("ผลลัพธ์แบบ Parquet ต้องระบุไฟล์ด้วย --output")
+
+    rule_set = load_rules(args.rules) if args.rules else DEFAULT_RULE_SET
+    records = run_batch(iter_image_paths(args.inputs), args.max_side, args.workers, args.chunk_size, rule_set,
+                        args.segment)
+    count = write_records(records, args.output, fmt)
+    print(f"วิเคราะห์แล้ว {count} ภาพ", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from leaf_bands import BAND_TABLE_VERSION
+
+DEFAULT_CACHE_DIR = os.environ.get("LEAF_CACHE_DIR", ".leaf_cache")
+DEFAULT_MAX_ENTRIES = int(os.environ.get("LEAF_CACHE_MAX_ENTRIES", "500"))
+# เพิ่มค่านี้ทุกครั้งที่โครงสร้างข้อมูลที่เก็บในแคชเปลี่ยน เพื่อไม่ให้อ่านรายการรูปแบบเก่า
+CACHE_FORMAT_VERSION = 6
+
+
+def image_key(image_bytes, *params):
+    # คีย์แคชจาก hash ของเนื้อไฟล์ภาพ + เวอร์ชันตารางแถบสีและรูปแบบแคช + พารามิเตอร์การวิเคราะห์
+    digest = hashlib.sha256(image_bytes)
+    digest.update(f"{BAND_TABLE_VERSION}:{CACHE_FORMAT_VERSION}".encode())
+    digest.update(repr(params).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    # แคชผลวิเคราะห์บนดิสก์ (ไฟล์ .npz แบบบีบอัด) ลบรายการที่ใช้ล่าสุดนานที่สุดออกเมื่อเกินจำนวนที่กำหนด
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_entries=DEFAULT_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "memory_misses": 0, "disk_hits": 0, "disk_misses": 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def record_lookup(self):
+        with self._lock:
+            self._stats["lookups"] += 1
+
+    def record_memory_miss(self):
+        with self._lock:
+            self._stats["memory_misses"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["memory_hits"] = stats["lookups"] - stats["memory_misses"]
+        return stats
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files if name != "__meta__"}
+                meta = json.loads(str(data["__meta__"]))
+            # แตะเวลาแก้ไขไฟล์เพื่อใช้เป็นลำดับ LRU
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self._stats["disk_misses"] += 1
+            return None
+        with self._lock:
+            self._stats["disk_hits"] += 1
+        return arrays, meta
+
+    def put(self, key, arrays, meta):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, __meta__=np.array(json.dumps(meta, ensure_ascii=False)), **arrays)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npz"):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    continue
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - self.max_entries]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
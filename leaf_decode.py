@@ -0,0 +1,133 @@
+import math
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from leaf_bands import downscale_max_side
+
+# โหมดของ PIL ที่แปลงเป็นอาร์เรย์ได้ตรง ๆ; โหมดอื่น (P, 1, CMYK, YCbCr, ...) แปลงเป็น RGB ก่อน
+_ARRAY_MODES = {"RGB", "RGBA", "L", "LA", "I", "I;16", "I;16B", "I;16L", "I;16N", "F"}
+
+# ขนาดด้านของ tile เมื่ออ่านภาพใหญ่ทีละส่วน
+DEFAULT_TILE_SIZE = 2048
+
+
+def to_rgb8(arr, top=None):
+    # แปลงอาร์เรย์ภาพทุกจำนวนช่องสีและความลึกบิตเป็น RGB 8 บิต คืน view เดิมเมื่อเป็น RGB 8 บิตอยู่แล้ว
+    # top คือค่าที่แทน 255 (ดู value_top) ถ้าไม่ระบุเลือกจากค่าสูงสุดของอาร์เรย์นี้เอง
+    if arr.ndim == 3 and arr.shape[2] in (1, 2):
+        arr = arr[..., 0]
+    if arr.dtype != np.uint8:
+        arr = _scale_to_uint8(arr, top)
+    if arr.ndim == 2:
+        return cv2.cvtColor(arr, cv2.COLOR_GRAY2RGB)
+    return arr[..., :3]
+
+
+def value_top(dtype, max_value):
+    # ค่าที่แทน 255 เมื่อแปลงเป็น 8 บิต: จำนวนเต็ม (เช่นภาพโหมด I ของ PIL ที่เป็น int32) มักเก็บค่า 8 หรือ 16 บิต
+    # ทศนิยมถือว่าอยู่ในช่วง 0-1 ถ้าค่าสูงสุดไม่เกิน 1
+    if np.issubdtype(dtype, np.integer):
+        return 255 if max_value <= 255 else 65535
+    return float(max_value) if max_value > 1.0 else 1.0
+
+
+def _scale_to_uint8(arr, top=None):
+    if arr.dtype == np.uint16:
+        return (arr >> 8).astype(np.uint8)
+    if top is None:
+        top = value_top(arr.dtype, np.nanmax(arr) if arr.size else 0)
+    if np.issubdtype(arr.dtype, np.integer):
+        return (np.clip(arr, 0, top) * (255 / top)).astype(np.uint8)
+    return np.clip(np.nan_to_num(arr) * (255 / top), 0, 255).astype(np.uint8)
+
+
+def to_rgb_array(image):
+    # รับได้ทั้ง PIL.Image และ numpy array คืน RGB 8 บิต
+    if isinstance(image, Image.Image):
+        if image.mode not in _ARRAY_MODES:
+            image = image.convert("RGB")
+        image = np.asarray(image)
+    return to_rgb8(image)
+
+
+def decode_image(source, max_side=None):
+    # ถอดรหัสภาพจากไฟล์/ไบต์ โดยลดความละเอียดระหว่างถอดรหัสเมื่อภาพใหญ่กว่าขนาดที่ใช้วิเคราะห์:
+    # JPEG ใช้ draft mode (ถอดรหัสที่ 1/2, 1/4, 1/8 ได้โดยตรง) รูปแบบอื่นใช้ Image.reduce
+    with Image.open(source) as image:
+        if max_side and max(image.size) > max_side:
+            scale = max_side / max(image.size)
+            image.draft(image.mode, (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+        if image.mode not in _ARRAY_MODES:
+            image = image.convert("RGB")
+        factor = int(max(image.size) // max_side) if max_side else 1
+        if factor >= 2:
+            try:
+                image = image.reduce(factor)
+            except ValueError:
+                pass
+        arr = to_rgb_array(image)
+    return downscale_max_side(arr, max_side)
+
+
+def _open_raster(path):
+    try:
+        import rasterio
+    except ImportError:
+        return None
+    try:
+        return rasterio.open(path)
+    except rasterio.errors.RasterioIOError:
+        return None
+
+
+def _dataset_top(dataset, bands, sample_side=1024):
+    # เลือกค่าที่แทน 255 ครั้งเดียวต่อ dataset แล้วใช้กับทุก tile เพื่อให้ค่าเดียวกันได้สีเดียวกันทุก tile
+    # uint8/uint16 ใช้ค่าตามชนิดข้อมูล ชนิดอื่นหาค่าสูงสุดจากภาพย่อทั้ง dataset (อ่านจาก overview ถ้ามี) ไม่นับ nodata
+    dtype = np.dtype(dataset.dtypes[bands[0] - 1])
+    if dtype in (np.uint8, np.uint16):
+        return None
+    step = max(1, math.ceil(max(dataset.width, dataset.height) / sample_side))
+    sample = dataset.read(bands, out_shape=(len(bands), max(1, dataset.height // step), max(1, dataset.width // step)),
+                          masked=True).compressed()
+    return value_top(dtype, np.nanmax(sample) if sample.size else 0)
+
+
+def iter_tiles(path, tile_size=DEFAULT_TILE_SIZE):
+    # อ่านภาพทีละ tile คืน (y, x, tile RGB 8 บิต, mask ของพิกเซลที่มีข้อมูลหรือ None)
+    # ใช้ rasterio (ถ้าติดตั้ง) อ่านแบบ windowed ทำให้หน่วยความจำคงที่แม้ภาพ orthomosaic ใหญ่กว่า RAM
+    # ถ้าไม่มี rasterio จะถอดรหัสทั้งภาพด้วย PIL แล้วแบ่ง tile: ใช้หน่วยความจำเท่าภาพเต็ม
+    # และอ่านได้ไม่เกินขีดจำกัดของ PIL (Image.MAX_IMAGE_PIXELS x 2 ประมาณ 179 MP)
+    dataset = _open_raster(path)
+    if dataset is None:
+        with Image.open(path) as image:
+            arr = to_rgb_array(image)
+        for y in range(0, arr.shape[0], tile_size):
+            for x in range(0, arr.shape[1], tile_size):
+                yield y, x, arr[y:y + tile_size, x:x + tile_size], None
+        return
+
+    from rasterio.windows import Window
+
+    with dataset:
+        bands = [1, 2, 3] if dataset.count >= 3 else [1]
+        top = _dataset_top(dataset, bands)
+        for y in range(0, dataset.height, tile_size):
+            for x in range(0, dataset.width, tile_size):
+                window = Window(x, y, min(tile_size, dataset.width - x), min(tile_size, dataset.height - y))
+                tile = np.moveaxis(dataset.read(bands, window=window), 0, -1)
+                valid = dataset.dataset_mask(window=window) > 0
+                yield y, x, np.ascontiguousarray(to_rgb8(tile, top)), valid
+
+
+def raster_size(path):
+    dataset = _open_raster(path)
+    if dataset is None:
+        try:
+            with Image.open(path) as image:
+                return image.size
+        except Image.DecompressionBombError as exc:
+            raise ValueError(f"ภาพใหญ่เกินกว่าที่ PIL อ่านได้ ต้องติดตั้ง rasterio เพื่ออ่านทีละ tile ({exc})") from exc
+    with dataset:
+        return dataset.width, dataset.height
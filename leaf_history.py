@@ -0,0 +1,277 @@
+import argparse
+import csv
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+from leaf_bands import BAND_NAMES, DEFAULT_MAX_SIDE, max_side_arg
+
+DEFAULT_HISTORY_DB = os.environ.get("LEAF_HISTORY_DB", "leaf_history.sqlite")
+PCT_COLUMNS = tuple(f"{name}_pct" for name in BAND_NAMES)
+# ค่าที่ติดตามแนวโน้ม: ค่าเฉลี่ยเคลื่อนที่ของ TREND_WINDOW สแกนล่าสุดเก็บไว้ในคอลัมน์ <ค่า>_mean ของแต่ละสแกน
+TREND_METRICS = ("yellow_pct", "edge_brown_pct", "disease_prob")
+TREND_WINDOW = 4
+# ตรวจจุดเปลี่ยนของ disease_prob ด้วย CUSUM ด้านขาขึ้น (หน่วยเป็นส่วนเบี่ยงเบนมาตรฐานของสแกนก่อนหน้า)
+# เริ่มตรวจเมื่อมีสแกนอ้างอิงอย่างน้อย MIN_BASELINE ครั้ง และถือว่าส่วนเบี่ยงเบนไม่ต่ำกว่า MIN_STD จุดเปอร์เซ็นต์
+CUSUM_K = 0.5
+CUSUM_H = 4.0
+MIN_BASELINE = 4
+MIN_STD = 1.0
+# path ของภาพในรูปแบบ .../<แปลง>/<ต้น>/<ไฟล์> ใช้แยกรหัสต้นและแปลงเมื่อนำเข้าทั้งโฟลเดอร์
+DEFAULT_PLANT_PATTERN = r"(?:(?P<plot>[^/\\]+)[/\\])?(?P<plant>[^/\\]+)[/\\][^/\\]+$"
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY,
+    plant_id TEXT NOT NULL,
+    plot_id TEXT,
+    ts REAL NOT NULL,
+    scan_key TEXT,
+    path TEXT,
+    {", ".join(f"{column} REAL" for column in PCT_COLUMNS)},
+    disease_prob REAL NOT NULL,
+    ph_status TEXT,
+    leaf_fraction REAL,
+    diagnoses TEXT,
+    {", ".join(f"{metric}_mean REAL" for metric in TREND_METRICS)},
+    cusum REAL NOT NULL,
+    change_point INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scans_plant_ts ON scans (plant_id, ts);
+CREATE UNIQUE INDEX IF NOT EXISTS scans_plant_key ON scans (plant_id, scan_key) WHERE scan_key IS NOT NULL;
+CREATE INDEX IF NOT EXISTS scans_change_points ON scans (ts) WHERE change_point = 1;
+CREATE TABLE IF NOT EXISTS plants (
+    plant_id TEXT PRIMARY KEY,
+    plot_id TEXT,
+    last_ts REAL NOT NULL,
+    last_scan_id INTEGER NOT NULL,
+    state TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS plants_plot ON plants (plot_id);
+"""
+_DERIVED_COLUMNS = tuple(f"{metric}_mean" for metric in TREND_METRICS) + ("cusum", "change_point")
+
+
+def scan_key(image_bytes):
+    # ภาพเดียวกันของต้นเดียวกันบันทึกได้ครั้งเดียว ไม่ว่าจะวิเคราะห์ซ้ำกี่ครั้ง
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def initial_state():
+    return {"n": 0, "mean": 0.0, "m2": 0.0, "cusum": 0.0, "window": {metric: [] for metric in TREND_METRICS}}
+
+
+def advance_trend(state, values):
+    # อัปเดตสถานะแนวโน้มของต้นด้วยสแกนใหม่หนึ่งครั้ง (แก้ state ในที่) คืนค่าที่คำนวณได้ของสแกนนั้น
+    # ใช้เฉพาะสถานะที่เก็บไว้ ไม่ต้องอ่านประวัติย้อนหลัง
+    derived = {}
+    for metric in TREND_METRICS:
+        window = (state["window"][metric] + [values[metric]])[-TREND_WINDOW:]
+        state["window"][metric] = window
+        derived[f"{metric}_mean"] = sum(window) / len(window)
+
+    x = values["disease_prob"]
+    change = False
+    if state["n"] >= MIN_BASELINE:
+        std = max(math.sqrt(state["m2"] / (state["n"] - 1)), MIN_STD)
+        state["cusum"] = max(0.0, state["cusum"] + (x - state["mean"]) / std - CUSUM_K)
+        change = state["cusum"] > CUSUM_H
+    derived["cusum"] = state["cusum"]
+    derived["change_point"] = int(change)
+    if change:
+        # ระดับใหม่กลายเป็นค่าอ้างอิงต่อจากนี้
+        state.update(n=0, mean=0.0, m2=0.0, cusum=0.0)
+
+    # ค่าเฉลี่ยและความแปรปรวนสะสมแบบ Welford
+    state["n"] += 1
+    delta = x - state["mean"]
+    state["mean"] += delta / state["n"]
+    state["m2"] += delta * (x - state["mean"])
+    return derived
+
+
+def _diagnosis_text(diagnoses):
+    if isinstance(diagnoses, dict):
+        return "; ".join(issue["name"] for issues in diagnoses.values() for issue in issues)
+    return diagnoses or ""
+
+
+class LeafHistory:
+    # ประวัติผลสแกนของแต่ละต้นใน SQLite: ตาราง scans เพิ่มแถวอย่างเดียว เรียงด้วย index (plant_id, ts)
+    # ตาราง plants เก็บสถานะแนวโน้มล่าสุดของแต่ละต้น สแกนใหม่จึงอัปเดตค่าเฉลี่ยเคลื่อนที่และ CUSUM ได้ทันที
+
+    def __init__(self, path=DEFAULT_HISTORY_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def add_scan(self, plant_id, record, ts=None, plot_id=None, key=None, path=None):
+        # record ใช้รูปแบบเดียวกับผลของ leaf-analyze (<แถบ>_pct, disease_prob, ph_status, leaf_fraction, diagnoses)
+        # คืนแถวที่บันทึกพร้อมค่าแนวโน้ม หรือ None ถ้าภาพนี้ (key) ของต้นนี้บันทึกไว้แล้ว
+        ts = time.time() if ts is None else float(ts)
+        values = {column: float(record[column]) for column in PCT_COLUMNS + ("disease_prob",)}
+        row = dict(values, plant_id=plant_id, plot_id=plot_id, ts=ts, scan_key=key, path=path,
+                   ph_status=record.get("ph_status"), leaf_fraction=record.get("leaf_fraction"),
+                   diagnoses=_diagnosis_text(record.get("diagnoses")))
+        with self._lock, self._conn:
+            if key is not None and self._conn.execute(
+                    "SELECT 1 FROM scans WHERE plant_id = ? AND scan_key = ?", (plant_id, key)).fetchone():
+                return None
+            plant = self._conn.execute("SELECT plot_id, last_ts, state FROM plants WHERE plant_id = ?",
+                                       (plant_id,)).fetchone()
+            in_order = plant is None or ts >= plant["last_ts"]
+            state = json.loads(plant["state"]) if plant is not None else initial_state()
+            if in_order:
+                row.update(advance_trend(state, values))
+            else:
+                row.update(dict.fromkeys(_DERIVED_COLUMNS, 0))
+            row["plot_id"] = plot_id if plot_id is not None else (plant["plot_id"] if plant is not None else None)
+            columns = list(row)
+            scan_id = self._conn.execute(
+                f"INSERT INTO scans ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                [row[column] for column in columns]).lastrowid
+            if in_order:
+                self._save_plant(plant_id, row["plot_id"], ts, scan_id, state)
+            else:
+                # สแกนย้อนหลัง: คำนวณแนวโน้มใหม่เฉพาะประวัติของต้นนี้
+                self._rebuild_plant(plant_id, row["plot_id"])
+            return dict(self._conn.execute("SELECT * FROM scans WHERE id = ?", (scan_id,)).fetchone())
+
+    def _save_plant(self, plant_id, plot_id, ts, scan_id, state):
+        self._conn.execute(
+            "INSERT INTO plants (plant_id, plot_id, last_ts, last_scan_id, state) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (plant_id) DO UPDATE SET plot_id = excluded.plot_id, last_ts = excluded.last_ts, "
+            "last_scan_id = excluded.last_scan_id, state = excluded.state",
+            (plant_id, plot_id, ts, scan_id, json.dumps(state)))
+
+    def _rebuild_plant(self, plant_id, plot_id):
+        state = initial_state()
+        for scan in self._conn.execute(
+                f"SELECT id, ts, {', '.join(PCT_COLUMNS)}, disease_prob FROM scans WHERE plant_id = ? ORDER BY ts, id",
+                (plant_id,)).fetchall():
+            derived = advance_trend(state, dict(scan))
+            self._conn.execute(f"UPDATE scans SET {', '.join(f'{column} = ?' for column in derived)} WHERE id = ?",
+                               list(derived.values()) + [scan["id"]])
+        self._save_plant(plant_id, plot_id, scan["ts"], scan["id"], state)
+
+    def _query(self, sql, params):
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    def history(self, plant_id, since=None, until=None):
+        # สแกนของต้นเรียงตามเวลา พร้อมค่าแนวโน้มที่คำนวณไว้แล้ว (อ่านช่วงของ index โดยตรง)
+        clauses, params = ["plant_id = ?"], [plant_id]
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("ts < ?")
+            params.append(until)
+        return self._query(f"SELECT * FROM scans WHERE {' AND '.join(clauses)} ORDER BY ts, id", params)
+
+    def latest(self, plot_id=None):
+        # สแกนล่าสุดของทุกต้น (หรือเฉพาะต้นในแปลง plot_id)
+        where, params = ("WHERE p.plot_id = ?", [plot_id]) if plot_id is not None else ("", [])
+        return self._query(f"SELECT s.* FROM plants p JOIN scans s ON s.id = p.last_scan_id {where} ORDER BY p.plant_id",
+                           params)
+
+    def change_points(self, since=None, plot_id=None):
+        # สแกนที่ disease_prob เพิ่มขึ้นอย่างมีนัยสำคัญ ใหม่สุดก่อน
+        clauses, params = ["change_point = 1"], []
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if plot_id is not None:
+            clauses.append("plot_id = ?")
+            params.append(plot_id)
+        return self._query(f"SELECT * FROM scans WHERE {' AND '.join(clauses)} ORDER BY ts DESC", params)
+
+
+def parse_time(text):
+    return datetime.fromisoformat(text).timestamp() if text else None
+
+
+def _write_rows(rows, columns):
+    writer = csv.writer(sys.stdout)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([datetime.fromtimestamp(row["ts"]).isoformat(timespec="seconds") if column == "ts"
+                         else row.get(column) for column in columns])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="เก็บและดูแนวโน้มผลสแกนใบของแต่ละต้นตามเวลา")
+    parser.add_argument("--db", default=DEFAULT_HISTORY_DB, help="ไฟล์ฐานข้อมูล SQLite")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="วิเคราะห์ภาพแล้วบันทึกลงประวัติ")
+    add.add_argument("inputs", nargs="+", help="โฟลเดอร์หรือ glob pattern ของภาพ")
+    add.add_argument("--plant", help="รหัสต้นของทุกภาพ (ค่าเริ่มต้น: แยกจาก path ด้วย --plant-pattern)")
+    add.add_argument("--plot", help="รหัสแปลง")
+    add.add_argument("--plant-pattern", default=DEFAULT_PLANT_PATTERN,
+                     help="regex ที่มีกลุ่ม plant (และ plot) สำหรับแยกรหัสจาก path")
+    add.add_argument("--ts", help="เวลาสแกนแบบ ISO 8601 (ค่าเริ่มต้น: เวลาแก้ไขไฟล์)")
+    add.add_argument("--max-side", type=max_side_arg, default=DEFAULT_MAX_SIDE)
+    add.add_argument("--no-segment", dest="segment", action="store_false")
+    trend = commands.add_parser("trend", help="พิมพ์ประวัติและแนวโน้มของต้นเป็น CSV")
+    trend.add_argument("plant")
+    trend.add_argument("--since", help="ตั้งแต่เวลา (ISO 8601)")
+    trend.add_argument("--until", help="ก่อนเวลา (ISO 8601)")
+    latest = commands.add_parser("latest", help="สแกนล่าสุดของทุกต้น")
+    latest.add_argument("--plot")
+    alerts = commands.add_parser("alerts", help="สแกนที่ disease_prob เพิ่มขึ้นผิดปกติ")
+    alerts.add_argument("--since", help="ตั้งแต่เวลา (ISO 8601)")
+    alerts.add_argument("--plot")
+    args = parser.parse_args(argv)
+
+    history = LeafHistory(args.db)
+    trend_columns = ["plant_id", "plot_id", "ts", "path"] + list(PCT_COLUMNS) + ["disease_prob", "ph_status"] \
+        + list(_DERIVED_COLUMNS)
+    if args.command == "add":
+        from leaf_batch import iter_image_paths, run_batch
+
+        pattern = re.compile(args.plant_pattern)
+        # run_batch คืนผลตามลำดับที่วิเคราะห์เสร็จ: เก็บไว้ก่อนแล้วบันทึกตามเวลา
+        # เพื่อให้ทุกสแกนต่อท้ายแนวโน้มได้ทันที ไม่ต้องคำนวณประวัติของต้นใหม่ทุกครั้งที่เจอสแกนย้อนหลัง
+        pending = []
+        for record in run_batch(iter_image_paths(args.inputs), args.max_side, segment=args.segment):
+            if "error" in record:
+                print(f"{record['path']}: {record['error']}", file=sys.stderr)
+                continue
+            match = pattern.search(record["path"])
+            plant_id = args.plant or (match and match.group("plant"))
+            if not plant_id:
+                print(f"{record['path']}: แยกรหัสต้นจาก path ไม่ได้ ระบุ --plant", file=sys.stderr)
+                continue
+            plot_id = args.plot or (match and match.groupdict().get("plot"))
+            with open(record["path"], "rb") as f:
+                key = scan_key(f.read())
+            ts = parse_time(args.ts) or os.path.getmtime(record["path"])
+            pending.append((ts, record["path"], plant_id, plot_id, key, record))
+        pending.sort(key=lambda item: item[:2])
+        added = sum(history.add_scan(plant_id, record, ts, plot_id, key, path) is not None
+                    for ts, path, plant_id, plot_id, key, record in pending)
+        print(f"บันทึกแล้ว {added} สแกน", file=sys.stderr)
+    elif args.command == "trend":
+        _write_rows(history.history(args.plant, parse_time(args.since), parse_time(args.until)), trend_columns)
+    elif args.command == "latest":
+        _write_rows(history.latest(args.plot), trend_columns)
+    else:
+        _write_rows(history.change_points(parse_time(args.since), args.plot), trend_columns)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import argparse
+import json
+import math
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from leaf_analysis import disease_diagnosis
+from leaf_bands import BAND_NAMES, classify_bands, downscale_max_side, max_side_arg, overlay_bands
+
+# ความละเอียดที่ใช้วิเคราะห์เฟรมวิดีโอ (ด้านยาวสุด) ต่ำกว่าโหมดภาพนิ่งเพื่อรักษาเฟรมเรต
+LIVE_MAX_SIDE = 320
+
+
+class LiveAnalyzer:
+    # วิเคราะห์เฟรมวิดีโอต่อเนื่อง: ข้ามเฟรมแบบปรับตัวตามเวลาที่ใช้วิเคราะห์จริง
+    # และเฉลี่ยเปอร์เซ็นต์แถบสีแบบเลื่อนหน้าต่าง เฟรมที่ถูกข้ามจะใช้ผลจำแนกล่าสุดในการซ้อนสี
+
+    def __init__(self, max_side=LIVE_MAX_SIDE, window=15, target_ms=15.0, max_skip=10, adaptive=True, skip=1):
+        self.max_side = max_side
+        self.target_ms = target_ms
+        self.max_skip = max_skip
+        self.adaptive = adaptive
+        self.skip = skip
+        self.history = deque(maxlen=window)
+        # คิวผลลัพธ์ขนาด 1: UI อ่านเฉพาะผลล่าสุด ผลเก่าที่ยังไม่ถูกอ่านจะถูกทิ้ง
+        self.results = queue.Queue(maxsize=1)
+        self._lock = threading.Lock()
+        self._frame_index = 0
+        self._codes = None
+        self._avg_ms = None
+        self._latest = None
+
+    def process(self, frame_rgb):
+        self._frame_index += 1
+        if self._codes is None or self._frame_index % self.skip == 0:
+            start = time.perf_counter()
+            small = downscale_max_side(frame_rgb, self.max_side)
+            codes, counts = classify_bands(cv2.cvtColor(small, cv2.COLOR_RGB2HSV))
+            self._codes = codes
+            self.history.append(counts / codes.size * 100)
+            self._update_skip((time.perf_counter() - start) * 1000)
+            self._publish()
+        return overlay_bands(frame_rgb, self._codes)
+
+    def _update_skip(self, elapsed_ms):
+        self._avg_ms = elapsed_ms if self._avg_ms is None else 0.8 * self._avg_ms + 0.2 * elapsed_ms
+        if self.adaptive:
+            self.skip = min(self.max_skip, max(1, math.ceil(self._avg_ms / self.target_ms)))
+
+    def _publish(self):
+        band_pcts = np.mean(self.history, axis=0)
+        summary = {
+            "frame": self._frame_index,
+            "band_pcts": dict(zip(BAND_NAMES, band_pcts.tolist())),
+            "disease_prob": float(band_pcts.mean()),
+            "diagnoses": disease_diagnosis(*band_pcts.tolist()),
+            "skip": self.skip,
+            "analysis_ms": self._avg_ms,
+        }
+        with self._lock:
+            self._latest = summary
+        try:
+            self.results.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self.results.put_nowait(summary)
+        except queue.Full:
+            pass
+
+    def latest(self):
+        with self._lock:
+            return self._latest
+
+
+class LeafVideoProcessor:
+    # ตัวประมวลผลเฟรมสำหรับ webrtc_streamer(video_processor_factory=LeafVideoProcessor)
+
+    def __init__(self):
+        self.analyzer = LiveAnalyzer()
+
+    def recv(self, frame):
+        img = self.analyzer.process(frame.to_ndarray(format="rgb24"))
+        return type(frame).from_ndarray(img, format="rgb24")
+
+
+def analyze_video(path, analyzer=None, output=None):
+    # ป้อนไฟล์วิดีโอที่บันทึกไว้ผ่านตัววิเคราะห์เดียวกับโหมดกล้องสด คืนผลสรุปของทุกเฟรมที่ถูกวิเคราะห์
+    analyzer = analyzer or LiveAnalyzer()
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise OSError(f"เปิดไฟล์วิดีโอไม่ได้: {path}")
+    writer = None
+    summaries = []
+    try:
+        while True:
+            ok, frame_bgr = capture.read()
+            if not ok:
+                break
+            overlay = analyzer.process(cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB))
+            summary = analyzer.latest()
+            if summary is not None and (not summaries or summaries[-1] is not summary):
+                summaries.append(summary)
+            if output is not None:
+                if writer is None:
+                    fps = capture.get(cv2.CAP_PROP_FPS) or 30
+                    writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*"mp4v"), fps,
+                                             (overlay.shape[1], overlay.shape[0]))
+                writer.write(cv2.cvtColor(overlay, cv2.COLOR_RGB2BGR))
+    finally:
+        capture.release()
+        if writer is not None:
+            writer.release()
+    return summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="วิเคราะห์ไฟล์วิดีโอด้วยตัววิเคราะห์ของโหมดกล้องสด")
+    parser.add_argument("video")
+    parser.add_argument("-o", "--output", help="บันทึกวิดีโอที่ซ้อนสีแถบที่ตรวจพบ")
+    parser.add_argument("--max-side", type=max_side_arg, default=LIVE_MAX_SIDE)
+    parser.add_argument("--skip", type=int, default=None, help="ข้ามเฟรมแบบคงที่แทนการปรับอัตโนมัติ")
+    args = parser.parse_args(argv)
+
+    if args.skip:
+        analyzer = LiveAnalyzer(args.max_side, adaptive=False, skip=args.skip)
+    else:
+        analyzer = LiveAnalyzer(args.max_side)
+    for summary in analyze_video(args.video, analyzer, args.output):
+        print(json.dumps(summary, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
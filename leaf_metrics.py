@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ตั้งค่า LEAF_METRICS_LOG เป็น path เพื่อบันทึกเวลาของทุกขั้นตอนเป็น JSONL
+METRICS_LOG = os.environ.get("LEAF_METRICS_LOG")
+# ตั้งค่า LEAF_TRACE_MEMORY=1 เพื่อวัดหน่วยความจำที่จองในแต่ละขั้นตอนด้วย tracemalloc (มี overhead)
+TRACE_MEMORY = os.environ.get("LEAF_TRACE_MEMORY") == "1"
+
+
+class StageMetrics:
+    # เก็บเวลาและหน่วยความจำของแต่ละขั้นตอนสะสมทั้งโปรเซส และเก็บรายการของ request ปัจจุบัน (ต่อเธรด)
+
+    def __init__(self, log_path=METRICS_LOG, trace_memory=TRACE_MEMORY):
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = {}
+        self._local = threading.local()
+        self._memory_owner = None
+        self._memory_contended = False
+        # จำนวน stage ที่เปิดอยู่ขณะนี้ในทุกเธรด (เฉพาะเมื่อ tracemalloc ทำงาน)
+        self._memory_active = 0
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        tracing = tracemalloc.is_tracing()
+        frame = self._memory_enter() if tracing else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            alloc_bytes = self._memory_exit(frame) if tracing else None
+            self._record(name, seconds, alloc_bytes)
+
+    def _memory_enter(self):
+        # peak ของ tracemalloc เป็นค่าเดียวทั้งโปรเซส จึงวัดได้ทีละเธรด: เธรดที่เข้า stage ขณะที่ไม่มี stage อื่นเปิดอยู่เลย
+        # เป็นเจ้าของการวัด stage ของเธรดอื่นที่ทำงานพร้อมกันได้ None และทำให้ค่าของเจ้าของเป็น None ด้วย
+        # เพราะปนการจองของเธรดอื่น เจ้าของคนใหม่เริ่มได้เมื่อ stage ของทุกเธรดปิดหมดแล้วเท่านั้น
+        ident = threading.get_ident()
+        with self._lock:
+            self._memory_active += 1
+            if self._memory_owner is None and self._memory_active == 1:
+                self._memory_owner = ident
+                self._memory_contended = False
+            elif self._memory_owner != ident:
+                self._memory_contended = True
+                return None
+        stack = self._local.__dict__.setdefault("memory_stack", [])
+        # stage ซ้อนกัน: เก็บ peak ที่ผ่านมาให้ stage ชั้นนอกก่อน reset_peak แล้วเก็บ [ค่าก่อนเริ่ม, peak]
+        current, peak = tracemalloc.get_traced_memory()
+        for outer in stack:
+            outer[1] = max(outer[1], peak)
+        tracemalloc.reset_peak()
+        frame = [current, current]
+        stack.append(frame)
+        return frame
+
+    def _memory_exit(self, frame):
+        if frame is None:
+            with self._lock:
+                self._memory_active -= 1
+            return None
+        stack = self._local.memory_stack
+        stack.pop()
+        peak = max(frame[1], tracemalloc.get_traced_memory()[1])
+        for outer in stack:
+            outer[1] = max(outer[1], peak)
+        with self._lock:
+            self._memory_active -= 1
+            contended = self._memory_contended
+            if not stack:
+                self._memory_owner = None
+        return None if contended else peak - frame[0]
+
+    def _record(self, name, seconds, alloc_bytes):
+        with self._lock:
+            stats = self._stages.setdefault(name, {"count": 0, "seconds": 0.0, "max_alloc_bytes": 0})
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            if alloc_bytes is not None:
+                stats["max_alloc_bytes"] = max(stats["max_alloc_bytes"], alloc_bytes)
+        record = {"ts": time.time(), "stage": name, "ms": seconds * 1000, "alloc_bytes": alloc_bytes}
+        trace = getattr(self._local, "trace", None)
+        if trace is not None:
+            trace.append(record)
+        if self.log_path:
+            line = json.dumps(record) + "\n"
+            with self._lock, open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def begin_trace(self):
+        # เริ่มรวบรวมขั้นตอนทั้งหมดที่ทำงานในเธรดนี้เป็นรายการสำหรับแสดงในหน้า debug
+        self._local.trace = []
+        return self._local.trace
+
+    def end_trace(self):
+        records = getattr(self._local, "trace", None)
+        self._local.trace = None
+        return records or []
+
+    def set_counter(self, name, value, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] = value
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stages.items()}
+
+    def prometheus(self):
+        # ข้อมูลทั้งหมดในรูปแบบ Prometheus text exposition
+        with self._lock:
+            stages = {name: dict(stats) for name, stats in self._stages.items()}
+            counters = dict(self._counters)
+        lines = [
+            "# HELP leaf_stage_seconds Wall time spent in each analysis stage.",
+            "# TYPE leaf_stage_seconds summary",
+        ]
+        for name, stats in sorted(stages.items()):
+            lines.append(f'leaf_stage_seconds_count{{stage="{name}"}} {stats["count"]}')
+            lines.append(f'leaf_stage_seconds_sum{{stage="{name}"}} {stats["seconds"]:.6f}')
+        lines += [
+            "# HELP leaf_stage_max_alloc_bytes Largest tracemalloc peak seen in each stage (stages overlapping another thread are skipped).",
+            "# TYPE leaf_stage_max_alloc_bytes gauge",
+        ]
+        for name, stats in sorted(stages.items()):
+            lines.append(f'leaf_stage_max_alloc_bytes{{stage="{name}"}} {stats["max_alloc_bytes"]}')
+        for (name, labels), value in sorted(counters.items()):
+            label_text = ",".join(f'{key}="{val}"' for key, val in labels)
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = StageMetrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = METRICS.prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host="0.0.0.0"):
+    # เปิด endpoint /metrics สำหรับ Prometheus ในเธรดเบื้องหลัง
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,175 @@
+import argparse
+import csv
+import json
+import sys
+
+import numpy as np
+
+from leaf_bands import BAND_NAMES
+
+CATEGORIES = ("โรค", "ธาตุอาหารหลัก (NPK)", "ธาตุอาหารรอง", "จุลธาตุ")
+
+# ตารางกฎการวินิจฉัย: เงื่อนไขใน "when" คือ (ชื่อแถบ, ">" หรือ "<", เกณฑ์เปอร์เซ็นต์)
+# "match": "all" (ค่าเริ่มต้น) = ต้องเป็นจริงทุกเงื่อนไข, "any" = เป็นจริงอย่างน้อยหนึ่งเงื่อนไข
+# ลำดับในตารางคือลำดับบิตของ bitset และลำดับที่แสดงในแต่ละหมวด
+RULES = (
+    {"id": "leaf_blight", "category": "โรค", "name": "โรคใบไหม้",
+     "description": "ใบมีจุดสีน้ำตาลจากการติดเชื้อรา", "recommendation": "ใช้สารฆ่าเชื้อราและตัดใบที่ติดเชื้อออก",
+     "when": [("brown", ">", 5.0)]},
+    {"id": "powdery_mildew", "category": "โรค", "name": "โรคราแป้ง",
+     "description": "ใบมีฝ้าสีขาวหรือเทาจากเชื้อรา", "recommendation": "ใช้สารกำจัดเชื้อราและปรับความชื้น",
+     "when": [("gray", ">", 3.0)]},
+    {"id": "leaf_spot", "category": "โรค", "name": "โรคจุดใบ/เน่า",
+     "description": "ใบมีจุดสีน้ำตาลเข้มถึงดำ", "recommendation": "กำจัดใบที่ติดเชื้อและใช้สารฆ่าเชื้อ",
+     "when": [("dark_brown", ">", 4.0)]},
+    {"id": "nitrogen", "category": "ธาตุอาหารหลัก (NPK)", "name": "ขาดไนโตรเจน (N)",
+     "description": "ใบเหลืองทั่วทั้งใบ", "recommendation": "ใส่ปุ๋ยไนโตรเจน เช่น ยูเรีย",
+     "when": [("yellow", ">", 10.0)]},
+    {"id": "phosphorus", "category": "ธาตุอาหารหลัก (NPK)", "name": "ขาดฟอสฟอรัส (P)",
+     "description": "ใบมีสีม่วงหรือแดง", "recommendation": "ใส่ปุ๋ยฟอสเฟต",
+     "when": [("purple", ">", 5.0)]},
+    {"id": "potassium", "category": "ธาตุอาหารหลัก (NPK)", "name": "ขาดโพแทสเซียม (K)",
+     "description": "ขอบใบไหม้สีน้ำตาล", "recommendation": "ใส่ปุ๋ยโพแทสเซียม เช่น โพแทสเซียมคลอไรด์",
+     "when": [("edge_brown", ">", 4.0)]},
+    {"id": "calcium", "category": "ธาตุอาหารรอง", "name": "ขาดแคลเซียม (Ca)",
+     "description": "ใบซีดหรือมีจุดขาว", "recommendation": "ใส่ปูนขาวหรือแคลเซียมไนเตรต",
+     "when": [("gray", ">", 3.0), ("brown", "<", 5.0)]},
+    {"id": "magnesium", "category": "ธาตุอาหารรอง", "name": "ขาดแมกนีเซียม (Mg)",
+     "description": "ใบเหลืองอ่อนระหว่างเส้นใบ", "recommendation": "ใส่แมกนีเซียมซัลเฟต",
+     "when": [("pale_yellow", ">", 5.0)]},
+    {"id": "sulfur", "category": "ธาตุอาหารรอง", "name": "ขาดกำมะถัน (S)",
+     "description": "ใบมีจุดน้ำตาลเข้ม", "recommendation": "ใส่ปุ๋ยที่มีกำมะถัน",
+     "when": [("dark_brown", ">", 4.0), ("yellow", "<", 10.0)]},
+    {"id": "iron", "category": "จุลธาตุ", "name": "ขาดเหล็ก (Fe)",
+     "description": "ใบซีดเหลืองระหว่างเส้นใบ", "recommendation": "ใส่ธาตุเหล็กคีเลต",
+     "when": [("pale_yellow", ">", 5.0), ("yellow", "<", 10.0)]},
+    {"id": "zinc", "category": "จุลธาตุ", "name": "ขาดสังกะสี (Zn)",
+     "description": "ใบมีจุดน้ำตาลเข้ม", "recommendation": "ใส่สังกะสีซัลเฟต",
+     "when": [("dark_brown", ">", 4.0), ("edge_brown", "<", 4.0)]},
+    {"id": "copper", "category": "จุลธาตุ", "name": "ขาดทองแดง (Cu)",
+     "description": "ใบน้ำตาลและม่วง", "recommendation": "ใส่ทองแดงซัลเฟต",
+     "when": [("brown", ">", 5.0), ("purple", ">", 5.0)]},
+)
+
+# กฎประเมินค่า pH: ใช้กฎแรกที่เป็นจริง ถ้าไม่มีกฎใดเป็นจริงใช้ PH_DEFAULT
+PH_RULES = (
+    {"id": "acidic", "status": "ดินอาจเป็นกรดสูง (pH < 6)", "match": "any",
+     "when": [("yellow", ">", 10.0), ("pale_yellow", ">", 10.0)]},
+    {"id": "alkaline", "status": "ดินอาจเป็นด่างสูง (pH > 7.5)",
+     "when": [("purple", ">", 5.0)]},
+)
+PH_DEFAULT = "ค่า pH อยู่ในช่วงปกติ (6-7.5)"
+
+
+def _compile(rules):
+    bands, signs, thresholds, starts, match_any = [], [], [], [], []
+    for rule in rules:
+        if not rule["when"]:
+            raise ValueError(f"กฎ {rule['id']!r} ต้องมีเงื่อนไขอย่างน้อยหนึ่งข้อ")
+        starts.append(len(bands))
+        match_any.append(rule.get("match", "all") == "any")
+        for band, op, threshold in rule["when"]:
+            if op not in (">", "<"):
+                raise ValueError(f"กฎ {rule['id']!r}: ไม่รู้จักตัวดำเนินการ {op!r}")
+            bands.append(BAND_NAMES.index(band))
+            signs.append(1.0 if op == ">" else -1.0)
+            thresholds.append(threshold)
+    return (np.array(bands), np.array(signs), np.array(thresholds, dtype=np.float64),
+            np.array(starts), np.array(match_any, dtype=bool))
+
+
+def evaluate_rules(band_pcts, rules=RULES):
+    # ประเมินทุกกฎกับทุกภาพพร้อมกัน: band_pcts เป็นเมทริกซ์ N x 7 (ลำดับคอลัมน์ตาม BAND_NAMES)
+    # คืน (fired: N x R bool, margins: N x R) โดย margin > 0 คือกฎเป็นจริง
+    # และ -margin คือระยะ (จุดเปอร์เซ็นต์) ที่ยังขาดจากเกณฑ์ของกฎที่ไม่เป็นจริง
+    band_pcts = np.atleast_2d(np.asarray(band_pcts, dtype=np.float64))
+    bands, signs, thresholds, starts, match_any = _compile(rules)
+    condition_margins = signs * (band_pcts[:, bands] - thresholds)
+    margins = np.where(match_any,
+                       np.maximum.reduceat(condition_margins, starts, axis=1),
+                       np.minimum.reduceat(condition_margins, starts, axis=1))
+    return margins > 0, margins
+
+
+def diagnosis_bitsets(fired):
+    # บีบผลกฎของแต่ละภาพเป็นจำนวนเต็มหนึ่งค่า (บิตที่ i = กฎลำดับที่ i เป็นจริง)
+    weights = np.left_shift(np.uint64(1), np.arange(fired.shape[1], dtype=np.uint64))
+    return (fired.astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64)
+
+
+def build_diagnoses(fired_row, rules=RULES):
+    diagnoses = {category: [] for category in CATEGORIES}
+    for rule, fired in zip(rules, fired_row):
+        if fired:
+            diagnoses.setdefault(rule["category"], []).append(
+                {"name": rule["name"], "description": rule["description"], "recommendation": rule["recommendation"]})
+    return diagnoses
+
+
+def ph_statuses(band_pcts, ph_rules=PH_RULES, default=PH_DEFAULT):
+    fired, _ = evaluate_rules(band_pcts, ph_rules)
+    statuses = np.array([rule["status"] for rule in ph_rules] + [default], dtype=object)
+    first = np.where(fired.any(axis=1), fired.argmax(axis=1), len(ph_rules))
+    return statuses[first].tolist()
+
+
+def load_rules(path):
+    # อ่านตารางกฎจากไฟล์ JSON {"rules": [...], "ph_rules": [...], "ph_default": "..."}
+    # ส่วนที่ไม่ระบุใช้ค่าเริ่มต้นของโมดูล
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    rules = tuple(data.get("rules", RULES))
+    ph_rules = tuple(data.get("ph_rules", PH_RULES))
+    _compile(rules)
+    _compile(ph_rules)
+    return rules, ph_rules, data.get("ph_default", PH_DEFAULT)
+
+
+def dump_rules(f, rules=RULES, ph_rules=PH_RULES, ph_default=PH_DEFAULT):
+    json.dump({"rules": rules, "ph_rules": ph_rules, "ph_default": ph_default}, f, ensure_ascii=False, indent=2)
+    f.write("\n")
+
+
+def _read_rows(path):
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return list(csv.DictReader(f))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ประเมินกฎการวินิจฉัยใหม่จากเปอร์เซ็นต์แถบสีที่บันทึกไว้ (ผลลัพธ์ของ leaf-analyze)")
+    parser.add_argument("results", nargs="?", help="ไฟล์ CSV หรือ JSONL ที่มีคอลัมน์ <แถบ>_pct")
+    parser.add_argument("--rules", help="ไฟล์ JSON ของตารางกฎ (ค่าเริ่มต้น: กฎในโค้ด)")
+    parser.add_argument("--margins", action="store_true", help="เพิ่มคอลัมน์ระยะห่างจากเกณฑ์ของทุกกฎ")
+    parser.add_argument("--dump", action="store_true", help="พิมพ์ตารางกฎเริ่มต้นเป็น JSON เพื่อนำไปแก้ไข")
+    args = parser.parse_args(argv)
+
+    if args.dump:
+        dump_rules(sys.stdout)
+        return
+    if not args.results:
+        parser.error("ต้องระบุไฟล์ผลลัพธ์")
+
+    rules, ph_rules, ph_default = load_rules(args.rules) if args.rules else (RULES, PH_RULES, PH_DEFAULT)
+    rows = [row for row in _read_rows(args.results) if row.get(f"{BAND_NAMES[0]}_pct") not in (None, "")]
+    band_pcts = np.array([[float(row[f"{name}_pct"]) for name in BAND_NAMES] for row in rows]).reshape(-1, len(BAND_NAMES))
+    fired, margins = evaluate_rules(band_pcts, rules)
+    bitsets = diagnosis_bitsets(fired)
+    statuses = ph_statuses(band_pcts, ph_rules, ph_default)
+
+    columns = ["path", "diagnosis_bits", "fired", "ph_status"]
+    if args.margins:
+        columns += [f"{rule['id']}_margin" for rule in rules]
+    writer = csv.writer(sys.stdout)
+    writer.writerow(columns)
+    for i, row in enumerate(rows):
+        out = [row.get("path", ""), int(bitsets[i]),
+               ";".join(rule["id"] for rule, hit in zip(rules, fired[i]) if hit), statuses[i]]
+        if args.margins:
+            out += [f"{margin:.3f}" for margin in margins[i]]
+        writer.writerow(out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import math
+
+import cv2
+import numpy as np
+
+from leaf_bands import BANDS, classify_bands, downscale_max_side
+
+# ด้านยาวสุดของภาพย่อที่ใช้แยกใบออกจากพื้นหลัง
+SEGMENT_SIDE = 256
+# ถ้าพื้นที่ใบที่พบน้อยกว่าสัดส่วนนี้ของภาพ ถือว่าแยกใบไม่สำเร็จและใช้ทั้งภาพ
+MIN_LEAF_FRACTION = 0.01
+# ส่วนที่มีสีของอาการ (แถบสีใดก็ได้) นับเป็นใบเมื่อเส้นรอบของส่วนนั้น (รวมส่วนที่แตะขอบภาพ) ติดกับเนื้อใบสีเขียว
+# อย่างน้อย MIN_SYMPTOM_LEAF_CONTACT และแตะขอบภาพไม่เกิน MAX_SYMPTOM_FRAME_CONTACT ของเส้นรอบ
+# แผลที่อยู่ในใบหรือขอบใบไหม้ผ่านเกณฑ์ ส่วนท้องฟ้า มือ หรือดินที่ล้อมใบและต่อไปถึงขอบภาพไม่ผ่าน
+MIN_SYMPTOM_LEAF_CONTACT = 0.4
+MAX_SYMPTOM_FRAME_CONTACT = 0.25
+# จำนวนรอบสูงสุดของการรวมส่วนที่มีสีของอาการเข้ากับใบ
+SYMPTOM_ROUNDS = 4
+# จุดเริ่มของใบแต่ละใบเมื่อแยกใบที่ติดกัน: พิกเซลที่ห่างจากขอบ mask เกินสัดส่วนนี้ของระยะมากที่สุดในส่วนนั้น
+# ใบที่ซ้อนกันจนคอคอดระหว่างใบกว้างเกินสัดส่วนนี้ หรือใบที่ชิดกันตลอดแนวขอบตรง จะยังนับเป็นใบเดียว
+SPLIT_SEED_FRACTION = 0.7
+# ถ้าเนื้อใบสีเขียวแตะขอบภาพเกินสัดส่วนนี้ของเส้นรอบภาพ ถือว่าเป็นภาพระยะใกล้ที่ใบเต็มภาพ และใช้ทั้งภาพ
+MAX_LEAF_BORDER = 0.6
+
+
+def _border_values(arr):
+    return np.concatenate((arr[0], arr[-1], arr[1:-1, 0], arr[1:-1, -1]))
+
+
+def _green_mask(small):
+    # เนื้อใบสีเขียวด้วยดัชนี ExG (2G - R - B) + Otsu แล้วปรับด้วย morphology
+    px = small.astype(np.int16)
+    r, g, b = px[..., 0], px[..., 1], px[..., 2]
+    exg = cv2.normalize(2 * g - r - b, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+    _, green = cv2.threshold(exg, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    size = max(3, (max(green.shape) // 64) | 1)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+    green = cv2.morphologyEx(green, cv2.MORPH_OPEN, kernel)
+    return cv2.morphologyEx(green, cv2.MORPH_CLOSE, kernel, iterations=2)
+
+
+def leaf_mask(img_rgb, work_side=SEGMENT_SIDE):
+    # แยกใบจากพื้นหลังบนภาพย่อ: หาเนื้อใบสีเขียว แล้วรวมส่วนที่มีสีของอาการ (น้ำตาล เหลือง เทา ฯลฯ) ที่ล้อมด้วย
+    # เนื้อใบเป็นส่วนใหญ่ เพราะอาการเหล่านี้มีค่า ExG ต่ำและจะหลุดเป็นพื้นหลังถ้าใช้ ExG อย่างเดียว
+    # จากนั้นเติมรูภายในขอบใบ คืน mask (0/255) ขนาดภาพย่อ ไม่ขยายขอบ mask เพื่อไม่ให้รวมพื้นหลังรอบใบ
+    # ข้อจำกัด: อาการที่ขอบใบซึ่งติดกับพื้นหลังสีเดียวกัน (เช่น ดินสีน้ำตาล) หรือถูกขอบภาพตัด อาจไม่ถูกนับเป็นใบ
+    small = downscale_max_side(img_rgb, work_side)
+    green = _green_mask(small)
+
+    codes, _ = classify_bands(cv2.cvtColor(small, cv2.COLOR_RGB2HSV))
+    leaf = green > 0
+    # พิจารณาทีละแถบสี แผลสีน้ำตาลที่ขอบใบจึงไม่ถูกรวมเป็นส่วนเดียวกับท้องฟ้าหรือกระดาษสีเทาที่อยู่ติดกัน
+    # พิกเซลรอบแต่ละส่วนที่มีสีของแถบอื่นไม่นับในเส้นรอบ และทำซ้ำหลายรอบโดยนับส่วนที่รวมแล้วเป็นเนื้อใบ
+    # เพื่อให้แผลที่ถูกล้อมด้วยพิกเซลผสมสีบาง ๆ (เช่น ขอบระหว่างสีเขียวกับสีน้ำตาลที่กลายเป็นสีเหลือง) ยังถูกรวม
+    for _ in range(SYMPTOM_ROUNDS):
+        banded = (codes > 0) & ~leaf
+        absorbed = np.zeros_like(leaf)
+        for bit in range(len(BANDS)):
+            part = banded & ((codes & np.uint8(1 << bit)) > 0)
+            if not part.any():
+                continue
+            n, labels = cv2.connectedComponents(part.astype(np.uint8), connectivity=8)
+            ring = cv2.dilate(labels.astype(np.float32), np.ones((3, 3), np.uint8)).astype(np.int32)
+            outside = ~banded & (ring > 0)
+            frame_contact = np.bincount(_border_values(labels), minlength=n)
+            contact = np.maximum(np.bincount(ring[outside], minlength=n) + frame_contact, 1)
+            leaf_contact = np.bincount(ring[outside & leaf], minlength=n)
+            keep = ((leaf_contact >= MIN_SYMPTOM_LEAF_CONTACT * contact)
+                    & (frame_contact <= MAX_SYMPTOM_FRAME_CONTACT * contact))
+            keep[0] = False
+            absorbed |= keep[labels]
+        if not absorbed.any():
+            break
+        leaf |= absorbed
+    mask = leaf.astype(np.uint8) * 255
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    min_area = mask.size * MIN_LEAF_FRACTION / 4
+    filled = np.zeros_like(mask)
+    cv2.drawContours(filled, [c for c in contours if cv2.contourArea(c) >= min_area], -1, 255, cv2.FILLED)
+    return filled
+
+
+def leaf_roi(img_rgb, work_side=SEGMENT_SIDE):
+    # คืน (slice ของกรอบใบในภาพเต็ม, mask ของใบขนาดเท่ากรอบ, สัดส่วนพื้นที่ใบ)
+    # หรือ None ถ้าไม่พบใบ หรือใบเต็มภาพจนแตะขอบภาพเกือบทั้งหมด (ใช้ทั้งภาพแทน)
+    small = leaf_mask(img_rgb, work_side)
+    fraction = cv2.countNonZero(small) / small.size
+    if fraction < MIN_LEAF_FRACTION:
+        return None
+    border = _border_values(small)
+    if np.count_nonzero(border) > MAX_LEAF_BORDER * border.size:
+        return None
+    x, y, w, h = cv2.boundingRect(small)
+    height, width = img_rgb.shape[:2]
+    sy, sx = height / small.shape[0], width / small.shape[1]
+    y0, x0 = int(y * sy), int(x * sx)
+    y1, x1 = min(height, math.ceil((y + h) * sy)), min(width, math.ceil((x + w) * sx))
+    mask = cv2.resize(np.ascontiguousarray(small[y:y + h, x:x + w]), (x1 - x0, y1 - y0),
+                      interpolation=cv2.INTER_NEAREST)
+    return (slice(y0, y1), slice(x0, x1)), mask, fraction
+
+
+def split_leaves(mask):
+    # แยกใบที่ติดหรือซ้อนกันใน mask: แกนกลางของแต่ละใบ (distance transform สูง) เป็นจุดเริ่ม แล้วขยายด้วย watershed
+    # ภายใน mask จนชนกันที่คอคอดระหว่างใบ คืน (จำนวนใบ, ป้าย int32 ขนาดเท่า mask โดย 0 = พื้นหลัง)
+    dist = cv2.distanceTransform(mask, cv2.DIST_L2, 5)
+    n, parts = cv2.connectedComponents(mask, connectivity=8)
+    peak = np.zeros(n, dtype=np.float32)
+    np.maximum.at(peak, parts.ravel(), dist.ravel())
+    seeds = (dist > SPLIT_SEED_FRACTION * peak[parts]).astype(np.uint8)
+    count, markers = cv2.connectedComponents(seeds, connectivity=8)
+    # cv2.watershed ขยายตามผลต่างของสีระหว่างพิกเซลข้างเคียง: ภายในใบสีเดียวกันจึงขยายจากจุดเริ่มทุกจุดพร้อมกัน
+    # ส่วนพื้นหลังเป็นป้ายของตัวเอง (count) ที่ต่างจากใบมากที่สุด จึงไม่ขยายเข้ามาในใบ
+    markers[mask == 0] = count
+    cv2.watershed(cv2.cvtColor(255 - mask, cv2.COLOR_GRAY2BGR), markers)
+    # เส้นแบ่ง (-1) ให้เป็นของใบข้างเคียง
+    edge = markers < 0
+    inside = np.where(edge | (markers == count), 0, markers).astype(np.float32)
+    markers[edge] = cv2.dilate(inside, np.ones((3, 3), np.uint8))[edge].astype(np.int32)
+    markers[(markers == count) | (mask == 0)] = 0
+    return count - 1, markers
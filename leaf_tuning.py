@@ -0,0 +1,198 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+from leaf_analysis import analyze_leaf
+from leaf_bands import BAND_NAMES, BAND_TABLE_VERSION, BANDS, DEFAULT_MAX_SIDE, max_side_arg
+from leaf_batch import iter_image_paths
+from leaf_decode import decode_image
+from leaf_rules import PH_DEFAULT, PH_RULES, RULES, evaluate_rules, load_rules, ph_statuses
+
+# ค่าขอบบน (แบบไม่รวม) ของแต่ละช่อง HSV แบบ OpenCV
+HSV_LIMITS = (180, 256, 256)
+# ระยะห่างของขอบ bin ในแต่ละช่อง H/S/V ของ histogram ที่เก็บไว้ปรับเกณฑ์
+# ขอบของช่วงสีใน BANDS ถูกเพิ่มเป็นขอบ bin เสมอ ค่าเริ่มต้นจึงได้เปอร์เซ็นต์ตรงกับ analyze_leaf ทุกประการ
+HIST_STEPS = (5, 16, 16)
+
+
+@lru_cache(maxsize=4)
+def hsv_quantizer(steps=HIST_STEPS):
+    # คืน (ขอบ bin ของแต่ละช่อง, ตารางแปลงค่า -> ลำดับ bin ของแต่ละช่อง)
+    edges, bins = [], []
+    for channel, (limit, step) in enumerate(zip(HSV_LIMITS, steps)):
+        values = set(range(0, limit, step)) | {limit}
+        for _, lower, upper in BANDS:
+            values.update((min(lower[channel], limit), min(upper[channel] + 1, limit)))
+        channel_edges = np.array(sorted(values))
+        # ค่าเท่ากับ limit (เช่น H = 180 ในช่วงของแถบ gray) นับอยู่ใน bin สุดท้าย
+        channel_bins = np.minimum(np.searchsorted(channel_edges, np.arange(limit + 1), side="right") - 1,
+                                  len(channel_edges) - 2).astype(np.int32)
+        channel_edges.setflags(write=False)
+        channel_bins.setflags(write=False)
+        edges.append(channel_edges)
+        bins.append(channel_bins)
+    return tuple(edges), tuple(bins)
+
+
+def hsv_histogram(img_hsv, mask=None, steps=HIST_STEPS):
+    # histogram 3 มิติของค่า HSV แบบ quantize (เฉพาะพิกเซลที่ mask ไม่เป็นศูนย์ถ้าระบุ)
+    edges, (h_bins, s_bins, v_bins) = hsv_quantizer(steps)
+    shape = tuple(len(channel_edges) - 1 for channel_edges in edges)
+    index = (h_bins[img_hsv[..., 0]] * shape[1] + s_bins[img_hsv[..., 1]]) * shape[2] + v_bins[img_hsv[..., 2]]
+    if mask is not None:
+        index = index[mask > 0]
+    return np.bincount(index.ravel(), minlength=shape[0] * shape[1] * shape[2]).reshape(shape).astype(np.uint32)
+
+
+def result_histogram(result, steps=HIST_STEPS):
+    # histogram ของพื้นที่เดียวกับที่ analyze_leaf ใช้นับเปอร์เซ็นต์ (ภายใน mask ของใบถ้ามี)
+    # ใช้ภาพ HSV ที่ analyze_leaf(keep_hsv=True) เก็บไว้ ไม่ต้องแปลงสีทั้งภาพซ้ำ
+    img_hsv = result.img_hsv if result.img_hsv is not None else cv2.cvtColor(result.img_rgb, cv2.COLOR_RGB2HSV)
+    return hsv_histogram(img_hsv, result.leaf_mask, steps)
+
+
+def summed_area_table(hists):
+    # ตารางผลรวมสะสม 3 มิติ (เติมศูนย์ด้านหน้าแต่ละแกน) รับ histogram เดียวหรือหลายภาพ (N x H x S x V)
+    # ผลรวมของพิกเซลทั้งภาพไม่เกิน 2^32 จึงเก็บเป็น uint32 เพื่อให้ชุดข้อมูลหลายพันภาพอยู่ในหน่วยความจำได้
+    hists = np.asarray(hists)
+    pad = [(0, 0)] * (hists.ndim - 3) + [(1, 0)] * 3
+    sat = np.pad(hists.astype(np.uint32), pad)
+    for axis in (-3, -2, -1):
+        np.cumsum(sat, axis=axis, dtype=np.uint32, out=sat)
+    return sat
+
+
+def band_boxes(bands=BANDS, steps=HIST_STEPS):
+    # แปลงช่วงสี (รวมค่าขอบทั้งสองด้าน) เป็นช่วง bin [ต่ำ, สูง) ของแต่ละแถบ: อาร์เรย์ B x 3 สองชุด
+    # ขอบที่ไม่ตรงขอบ bin ถูกขยายออกให้ครอบ bin ที่ค่านั้นอยู่ ดูค่าที่ใช้จริงได้จาก snap_bands
+    # ช่วงที่ค่าสูงสุดต่ำกว่าค่าต่ำสุด (เช่น แถบเลื่อนทั้งสองปลายอยู่ที่ 0) เป็นกล่องว่าง
+    _, bins = hsv_quantizer(steps)
+    lower = np.array([[bins[c][lo[c]] for c in range(3)] for _, lo, _ in bands])
+    upper = np.array([[bins[c][up[c]] + 1 if up[c] >= lo[c] else bins[c][lo[c]] for c in range(3)]
+                      for _, lo, up in bands])
+    return lower, np.maximum(upper, lower)
+
+
+def snap_bands(bands=BANDS, steps=HIST_STEPS):
+    # ช่วงสีที่ histogram นับได้จริงหลังปรับขอบให้ตรงขอบ bin ในรูปแบบเดียวกับ BANDS
+    edges, _ = hsv_quantizer(steps)
+    lower, upper = band_boxes(bands, steps)
+    return tuple((name, tuple(int(edges[c][lo[c]]) for c in range(3)), tuple(int(edges[c][up[c]]) - 1 for c in range(3)))
+                 for (name, _, _), lo, up in zip(bands, lower, upper))
+
+
+def band_counts_from_sat(sat, bands=BANDS, steps=HIST_STEPS):
+    # จำนวนพิกเซลในกล่อง HSV ของทุกแถบด้วยตาราง SAT: 8 ค่าต่อแถบต่อภาพ ไม่ต้องวนพิกเซลใหม่
+    (h0, s0, v0), (h1, s1, v1) = (box.T for box in band_boxes(bands, steps))
+
+    def at(h, s, v):
+        return sat[..., h, s, v].astype(np.int64)
+
+    return (at(h1, s1, v1) - at(h0, s1, v1) - at(h1, s0, v1) - at(h1, s1, v0)
+            + at(h0, s0, v1) + at(h0, s1, v0) + at(h1, s0, v0) - at(h0, s0, v0))
+
+
+def rescore(sat, bands=BANDS, rules=RULES, ph_rules=PH_RULES, ph_default=PH_DEFAULT, steps=HIST_STEPS):
+    # ประเมินภาพเดียวหรือทั้งชุดใหม่ด้วยช่วงสีและกฎที่ปรับแล้ว
+    # คืน (band_pcts: N x 7, disease_prob: N, fired: N x R, ph_status: list)
+    sat = np.asarray(sat)
+    if sat.ndim == 3:
+        sat = sat[None]
+    totals = np.maximum(sat[:, -1, -1, -1].astype(np.int64), 1)
+    band_pcts = band_counts_from_sat(sat, bands, steps) / totals[:, None] * 100
+    fired, _ = evaluate_rules(band_pcts, rules)
+    return band_pcts, band_pcts.mean(axis=1), fired, ph_statuses(band_pcts, ph_rules, ph_default)
+
+
+def load_bands(path):
+    # อ่านช่วงสีจากไฟล์ JSON {"bands": [[ชื่อ, [H, S, V ต่ำสุด], [H, S, V สูงสุด]], ...]} ชื่อและลำดับต้องตรงกับ BAND_NAMES
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    bands = tuple((name, tuple(lower), tuple(upper)) for name, lower, upper in data["bands"])
+    if tuple(name for name, _, _ in bands) != BAND_NAMES:
+        raise ValueError(f"ลำดับแถบสีต้องเป็น {', '.join(BAND_NAMES)}")
+    return bands
+
+
+def dump_bands(f, bands=BANDS):
+    json.dump({"bands": bands}, f, ensure_ascii=False, indent=2)
+    f.write("\n")
+
+
+def _histogram_path(path, max_side, segment):
+    try:
+        return path, result_histogram(analyze_leaf(decode_image(path, max_side), max_side, segment, keep_hsv=True))
+    except Exception as exc:
+        print(f"{path}: {type(exc).__name__}: {exc}", file=sys.stderr)
+        return path, None
+
+
+def build_dataset(paths, output, max_side=DEFAULT_MAX_SIDE, segment=True, workers=None):
+    # วิเคราะห์ภาพทั้งชุดครั้งเดียวแล้วเก็บเฉพาะ histogram HSV ของแต่ละภาพ สำหรับปรับเกณฑ์ภายหลัง
+    paths = list(paths)
+    kept, hists = [], []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        for path, hist in pool.map(_histogram_path, paths, [max_side] * len(paths), [segment] * len(paths),
+                                   chunksize=8):
+            if hist is not None:
+                kept.append(path)
+                hists.append(hist)
+    edges, _ = hsv_quantizer()
+    shape = tuple(len(channel_edges) - 1 for channel_edges in edges)
+    np.savez_compressed(output, paths=np.array(kept, dtype=str), hists=np.array(hists, dtype=np.uint32).reshape(-1, *shape),
+                        steps=np.array(HIST_STEPS), band_table=np.array(BAND_TABLE_VERSION))
+    return len(kept)
+
+
+def load_dataset(source):
+    # คืน (รายชื่อไฟล์, SAT ของทุกภาพ) จากไฟล์ที่สร้างด้วย build_dataset (รับได้ทั้ง path และ file object)
+    with np.load(source, allow_pickle=False) as data:
+        if str(data["band_table"]) != BAND_TABLE_VERSION or tuple(data["steps"]) != HIST_STEPS:
+            raise ValueError("ชุดข้อมูลสร้างจากตารางแถบสีหรือขนาด bin อื่น ต้องสร้างใหม่ด้วย leaf_tuning.py build")
+        return data["paths"].tolist(), summed_area_table(data["hists"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="เก็บ histogram HSV ของภาพทั้งชุด แล้วประเมินใหม่ด้วยช่วงสีและกฎที่ปรับแล้วโดยไม่ต้องวิเคราะห์ภาพซ้ำ")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="สร้างไฟล์ histogram ของภาพทั้งชุด")
+    build.add_argument("inputs", nargs="+", help="โฟลเดอร์หรือ glob pattern ของภาพ")
+    build.add_argument("-o", "--output", required=True, help="ไฟล์ .npz ผลลัพธ์")
+    build.add_argument("-j", "--workers", type=int, default=None)
+    build.add_argument("--max-side", type=max_side_arg, default=DEFAULT_MAX_SIDE)
+    build.add_argument("--no-segment", dest="segment", action="store_false")
+    score = commands.add_parser("score", help="ประเมินไฟล์ histogram ใหม่ พิมพ์ผลเป็น CSV")
+    score.add_argument("dataset", help="ไฟล์ .npz จากคำสั่ง build")
+    score.add_argument("--bands", help="ไฟล์ JSON ของช่วงสี (ดูคำสั่ง dump-bands)")
+    score.add_argument("--rules", help="ไฟล์ JSON ของตารางกฎ (ดู python leaf_rules.py --dump)")
+    commands.add_parser("dump-bands", help="พิมพ์ช่วงสีเริ่มต้นเป็น JSON เพื่อนำไปแก้ไข")
+    args = parser.parse_args(argv)
+
+    if args.command == "dump-bands":
+        dump_bands(sys.stdout)
+    elif args.command == "build":
+        count = build_dataset(iter_image_paths(args.inputs), args.output, args.max_side, args.segment,
+                              args.workers)
+        print(f"บันทึก histogram แล้ว {count} ภาพ", file=sys.stderr)
+    else:
+        bands = load_bands(args.bands) if args.bands else BANDS
+        rules, ph_rules, ph_default = load_rules(args.rules) if args.rules else (RULES, PH_RULES, PH_DEFAULT)
+        paths, sat = load_dataset(args.dataset)
+        band_pcts, disease_prob, fired, statuses = rescore(sat, bands, rules, ph_rules, ph_default)
+        writer = csv.writer(sys.stdout)
+        writer.writerow(["path"] + [f"{name}_pct" for name in BAND_NAMES] + ["disease_prob", "fired", "ph_status"])
+        for i, path in enumerate(paths):
+            writer.writerow([path] + [f"{pct:.3f}" for pct in band_pcts[i]]
+                            + [f"{disease_prob[i]:.3f}", ";".join(rule["id"] for rule, hit in zip(rules, fired[i]) if hit),
+                               statuses[i]])
+
+
+if __name__ == "__main__":
+    main()
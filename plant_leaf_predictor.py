@@ -1,21 +1,12 @@
-import streamlit as st
-import numpy as np
-import cv2
-from PIL import Image
-import matplotlib.pyplot as plt
-import matplotlib
-
-# ตั้งค่าฟอนต์ให้รองรับภาษาไทย
-matplotlib.rc("font", family="Tahoma")
+import io
+import os
+import queue
+from datetime import date, datetime
 
-# ตั้งค่าธีมสีที่ทันสมัย (พื้นหลังสีดำ) และเปลี่ยนไอคอน
-st.set_page_config(
-    page_title="ระบบวิเคราะห์โรคและธาตุอาหารใบพืช",
-    layout="wide",
-    page_icon="durian_leaf1.png"  # เปลี่ยนเป็น path ของไฟล์โลโก้คุณ
-)
+import streamlit as st
 
-st.markdown("""
+LOGO_PATH = "durian_leaf1.png"  # เปลี่ยนเป็น path ของไฟล์โลโก้คุณ
+PAGE_CSS = """
 <style>
     .main {background-color: #000000;}
     .stButton>button {background-color: #4CAF50; color: white; border-radius: 10px;}
@@ -24,176 +15,323 @@ st.markdown("""
     .metric-card {background-color: #1a1a1a; padding: 15px; border-radius: 10px; box-shadow: 0 2px 4px rgba(255,255,255,0.1); text-align: center; color: #ffffff;}
     h1, h2, h3, p, div {color: #ffffff;}
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# อ่านและย่อไฟล์โลโก้ (1024 px, ~1.3 MB) ครั้งเดียวต่อโปรเซส แล้วเก็บเป็น PNG ขนาดเล็กที่พร้อมส่งให้เบราว์เซอร์
+# รันใหม่แต่ละครั้งจึงไม่ต้องอ่านดิสก์ ถอดรหัส PNG หรือส่งไฟล์เต็มขนาดซ้ำ
+@st.cache_resource(show_spinner=False)
+def load_page_assets():
+    from PIL import Image
+
+    with Image.open(LOGO_PATH) as logo:
+        logo.load()
+        assets = {}
+        for name, side in (("icon", 64), ("logo", 100)):
+            small = logo.copy()
+            small.thumbnail((side, side), Image.LANCZOS)
+            buffer = io.BytesIO()
+            small.save(buffer, format="PNG", optimize=True)
+            assets[name] = buffer.getvalue()
+    return assets
+
+page_assets = load_page_assets()
+
+# ตั้งค่าธีมสีที่ทันสมัย (พื้นหลังสีดำ) และเปลี่ยนไอคอน
+st.set_page_config(
+    page_title="ระบบวิเคราะห์โรคและธาตุอาหารใบพืช",
+    layout="wide",
+    page_icon=page_assets["icon"]
+)
+
+st.markdown(PAGE_CSS, unsafe_allow_html=True)
 
 # แสดงโลโก้ข้างชื่อ
-st.image("durian_leaf1.png", width=50)  # เปลี่ยนเป็น path ของไฟล์โลโก้คุณ
+st.image(page_assets["logo"], width=50)
 st.title("🌿 WEB APP วิเคราะห์โรคและธาตุอาหารใบพืช")
 
-def analyze_leaf(image):
-    img_array = np.array(image)
-    img_rgb = cv2.cvtColor(img_array, cv2.COLOR_RGBA2RGB)
-    img_hsv = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2HSV)
-    
-    lower_brown = np.array([10, 50, 50])
-    upper_brown = np.array([30, 255, 255])
-    brown_mask = cv2.inRange(img_hsv, lower_brown, upper_brown)
-    
-    lower_yellow = np.array([20, 40, 100])
-    upper_yellow = np.array([40, 255, 255])
-    yellow_mask = cv2.inRange(img_hsv, lower_yellow, upper_yellow)
-    
-    lower_purple = np.array([120, 40, 50])
-    upper_purple = np.array([160, 255, 255])
-    purple_mask = cv2.inRange(img_hsv, lower_purple, upper_purple)
-    
-    lower_edge_brown = np.array([5, 50, 20])
-    upper_edge_brown = np.array([20, 255, 100])
-    edge_brown_mask = cv2.inRange(img_hsv, lower_edge_brown, upper_edge_brown)
-    
-    lower_gray = np.array([0, 0, 150])
-    upper_gray = np.array([180, 30, 255])
-    gray_mask = cv2.inRange(img_hsv, lower_gray, upper_gray)
-    
-    lower_pale_yellow = np.array([25, 20, 150])
-    upper_pale_yellow = np.array([35, 100, 255])
-    pale_yellow_mask = cv2.inRange(img_hsv, lower_pale_yellow, upper_pale_yellow)
-    
-    lower_dark_brown = np.array([5, 50, 20])
-    upper_dark_brown = np.array([20, 255, 100])
-    dark_brown_mask = cv2.inRange(img_hsv, lower_dark_brown, upper_dark_brown)
-    
-    total_pixels = img_hsv.shape[0] * img_hsv.shape[1]
-    brown_pct = (np.sum(brown_mask > 0) / total_pixels) * 100
-    yellow_pct = (np.sum(yellow_mask > 0) / total_pixels) * 100
-    purple_pct = (np.sum(purple_mask > 0) / total_pixels) * 100
-    edge_brown_pct = (np.sum(edge_brown_mask > 0) / total_pixels) * 100
-    gray_pct = (np.sum(gray_mask > 0) / total_pixels) * 100
-    pale_yellow_pct = (np.sum(pale_yellow_mask > 0) / total_pixels) * 100
-    dark_brown_pct = (np.sum(dark_brown_mask > 0) / total_pixels) * 100
-    
-    disease_prob = (brown_pct + yellow_pct + purple_pct + edge_brown_pct + gray_pct + pale_yellow_pct + dark_brown_pct) / 7
+# โหลด numpy/OpenCV และโมดูลวิเคราะห์หลังส่งส่วนหัวของหน้าไปแล้ว หน้าเว็บจึงแสดงขึ้นก่อนขณะเริ่มโปรเซสใหม่
+# โมดูลที่ใช้เฉพาะบางโหมด (ปรับเกณฑ์, แยกทีละใบ, กล้องสด) นำเข้าเมื่อใช้งานครั้งแรกในฟังก์ชันของโหมดนั้น
+import cv2
+from leaf_bands import BAND_NAMES, DEFAULT_MAX_SIDE, band_preview, overlay_bands, resize_to_width
+from leaf_cache import ResultCache, image_key
+from leaf_metrics import METRICS, start_metrics_server
+
+def plot_rgb_histogram(hist):
+    st.area_chart({"แดง": hist[0], "เขียว": hist[1], "น้ำเงิน": hist[2]},
+                  color=["#FF6B6B", "#4CAF50", "#4D96FF"], x_label="ค่าพิกเซล", y_label="ความถี่")
+
+# ความกว้างของภาพแสดงผลที่เก็บในแคช ภาพของแต่ละแถบสร้างจากภาพขนาดนี้เมื่อแสดงผล
+PREVIEW_WIDTH = 300
+
+@st.cache_resource
+def get_result_cache():
+    return ResultCache()
+
+# ตั้งค่า LEAF_METRICS_PORT เพื่อเปิด endpoint /metrics (Prometheus) ครั้งเดียวต่อโปรเซส
+@st.cache_resource
+def get_metrics_server():
+    port = os.environ.get("LEAF_METRICS_PORT")
+    return start_metrics_server(int(port)) if port else None
+
+# แคชในหน่วยความจำ (จำกัดจำนวนและอายุ) ซ้อนบนแคชบนดิสก์ที่อยู่รอดหลังรีสตาร์ตเซิร์ฟเวอร์
+# histogram HSV สำหรับปรับเกณฑ์สร้างเฉพาะเมื่อเปิดโหมดปรับเกณฑ์ (tune) โดยใช้ภาพ HSV จาก analyze_leaf
+@st.cache_data(max_entries=32, ttl=3600, show_spinner=False)
+def cached_analysis(key, _image_bytes, max_side, segment, tune=False):
+    from leaf_analysis import analyze_leaf, diagnose, rgb_histogram
+    from leaf_decode import decode_image
+    from leaf_tuning import result_histogram
+
+    cache = get_result_cache()
+    cache.record_memory_miss()
+    with METRICS.stage("disk_cache_get"):
+        cached = cache.get(key)
+    if cached is not None:
+        return cached
     
-    if yellow_pct > 10 or pale_yellow_pct > 10:
-        ph_status = "ดินอาจเป็นกรดสูง (pH < 6)"
-    elif purple_pct > 5:
-        ph_status = "ดินอาจเป็นด่างสูง (pH > 7.5)"
+    with METRICS.stage("decode"):
+        img_rgb = decode_image(io.BytesIO(_image_bytes), max_side)
+    with METRICS.stage("analysis"):
+        result = analyze_leaf(img_rgb, max_side, segment, keep_hsv=tune)
+    with METRICS.stage("overlay"):
+        arrays = {
+            "preview_rgb": resize_to_width(result.img_rgb, PREVIEW_WIDTH),
+            "preview_codes": resize_to_width(result.band_codes, PREVIEW_WIDTH, interpolation=cv2.INTER_NEAREST),
+        }
+    with METRICS.stage("histogram"):
+        arrays["rgb_hist"] = rgb_histogram(result.img_rgb, result.leaf_mask)
+    if tune:
+        with METRICS.stage("hsv_histogram"):
+            arrays["hsv_hist"] = result_histogram(result)
+    with METRICS.stage("diagnosis"):
+        meta = result.to_dict()
+        meta["diagnoses"] = diagnose(result)
+    with METRICS.stage("disk_cache_put"):
+        cache.put(key, arrays, meta)
+    return arrays, meta
+
+@st.cache_data(max_entries=16, ttl=3600, show_spinner=False)
+def cached_leaves(key, _image_bytes, max_side):
+    from leaf_analysis import analyze_leaves, leaves_overlay
+    from leaf_decode import decode_image
+
+    leaves = analyze_leaves(decode_image(io.BytesIO(_image_bytes), max_side), max_side)
+    rows = leaves.rows()
+    for row in rows:
+        row["diagnoses"] = " · ".join(issue["name"] for issues in row["diagnoses"].values() for issue in issues)
+    return leaves_overlay(leaves, width=800), rows
+
+def render_leaf_table(image_bytes, max_side):
+    with st.spinner("กำลังแยกและวิเคราะห์ทีละใบ..."):
+        overlay, rows = cached_leaves(image_key(image_bytes, max_side, "leaves"), image_bytes, max_side)
+    st.subheader(f"🍃 ผลวิเคราะห์แยกทีละใบ ({len(rows)} ใบ)")
+    st.image(overlay, caption="หมายเลขใบและแถบสีที่ตรวจพบ")
+    if rows:
+        st.dataframe(rows, hide_index=True)
     else:
-        ph_status = "ค่า pH อยู่ในช่วงปกติ (6-7.5)"
-    
-    brown_highlight = cv2.bitwise_and(img_rgb, img_rgb, mask=brown_mask)
-    yellow_highlight = cv2.bitwise_and(img_rgb, img_rgb, mask=yellow_mask)
-    purple_highlight = cv2.bitwise_and(img_rgb, img_rgb, mask=purple_mask)
-    edge_brown_highlight = cv2.bitwise_and(img_rgb, img_rgb, mask=edge_brown_mask)
-    gray_highlight = cv2.bitwise_and(img_rgb, img_rgb, mask=gray_mask)
-    pale_yellow_highlight = cv2.bitwise_and(img_rgb, img_rgb, mask=pale_yellow_mask)
-    dark_brown_highlight = cv2.bitwise_and(img_rgb, img_rgb, mask=dark_brown_mask)
-    
-    return (brown_highlight, yellow_highlight, purple_highlight, edge_brown_highlight, gray_highlight, 
-            pale_yellow_highlight, dark_brown_highlight, img_rgb, brown_pct, yellow_pct, purple_pct, 
-            edge_brown_pct, gray_pct, pale_yellow_pct, dark_brown_pct, disease_prob, ph_status)
-
-def plot_rgb_histogram(image):
-    r, g, b = cv2.split(image)
-    plt.figure(figsize=(10, 4), facecolor="#000000")
-    plt.hist(r.ravel(), bins=256, color='#FF6B6B', alpha=0.7, label='แดง')
-    plt.hist(g.ravel(), bins=256, color='#4CAF50', alpha=0.7, label='เขียว')
-    plt.hist(b.ravel(), bins=256, color='#4D96FF', alpha=0.7, label='น้ำเงิน')
-    plt.title("การกระจายตัวของค่าสี RGB", fontsize=14, pad=10, color='white')
-    plt.xlabel("ค่าพิกเซล", fontsize=12, color='white')
-    plt.ylabel("ความถี่", fontsize=12, color='white')
-    plt.legend(prop={'size': 10}, facecolor='#1a1a1a', edgecolor='white', labelcolor='white')
-    plt.grid(True, linestyle='--', alpha=0.3, color='gray')
-    plt.tick_params(axis='x', colors='white')
-    plt.tick_params(axis='y', colors='white')
-    st.pyplot(plt)
-
-def disease_diagnosis(brown_pct, yellow_pct, purple_pct, edge_brown_pct, gray_pct, pale_yellow_pct, dark_brown_pct):
-    diagnoses = {
-        "โรค": [],
-        "ธาตุอาหารหลัก (NPK)": [],
-        "ธาตุอาหารรอง": [],
-        "จุลธาตุ": []
-    }
-    
-    if brown_pct > 5.0:
-        diagnoses["โรค"].append({"name": "โรคใบไหม้", "description": "ใบมีจุดสีน้ำตาลจากการติดเชื้อรา", "recommendation": "ใช้สารฆ่าเชื้อราและตัดใบที่ติดเชื้อออก"})
-    if gray_pct > 3.0:
-        diagnoses["โรค"].append({"name": "โรคราแป้ง", "description": "ใบมีฝ้าสีขาวหรือเทาจากเชื้อรา", "recommendation": "ใช้สารกำจัดเชื้อราและปรับความชื้น"})
-    if dark_brown_pct > 4.0:
-        diagnoses["โรค"].append({"name": "โรคจุดใบ/เน่า", "description": "ใบมีจุดสีน้ำตาลเข้มถึงดำ", "recommendation": "กำจัดใบที่ติดเชื้อและใช้สารฆ่าเชื้อ"})
-    
-    if yellow_pct > 10.0:
-        diagnoses["ธาตุอาหารหลัก (NPK)"].append({"name": "ขาดไนโตรเจน (N)", "description": "ใบเหลืองทั่วทั้งใบ", "recommendation": "ใส่ปุ๋ยไนโตรเจน เช่น ยูเรีย"})
-    if purple_pct > 5.0:
-        diagnoses["ธาตุอาหารหลัก (NPK)"].append({"name": "ขาดฟอสฟอรัส (P)", "description": "ใบมีสีม่วงหรือแดง", "recommendation": "ใส่ปุ๋ยฟอสเฟต"})
-    if edge_brown_pct > 4.0:
-        diagnoses["ธาตุอาหารหลัก (NPK)"].append({"name": "ขาดโพแทสเซียม (K)", "description": "ขอบใบไหม้สีน้ำตาล", "recommendation": "ใส่ปุ๋ยโพแทสเซียม เช่น โพแทสเซียมคลอไรด์"})
-    
-    if gray_pct > 3.0 and brown_pct < 5.0:
-        diagnoses["ธาตุอาหารรอง"].append({"name": "ขาดแคลเซียม (Ca)", "description": "ใบซีดหรือมีจุดขาว", "recommendation": "ใส่ปูนขาวหรือแคลเซียมไนเตรต"})
-    if pale_yellow_pct > 5.0:
-        diagnoses["ธาตุอาหารรอง"].append({"name": "ขาดแมกนีเซียม (Mg)", "description": "ใบเหลืองอ่อนระหว่างเส้นใบ", "recommendation": "ใส่แมกนีเซียมซัลเฟต"})
-    if dark_brown_pct > 4.0 and yellow_pct < 10.0:
-        diagnoses["ธาตุอาหารรอง"].append({"name": "ขาดกำมะถัน (S)", "description": "ใบมีจุดน้ำตาลเข้ม", "recommendation": "ใส่ปุ๋ยที่มีกำมะถัน"})
-    
-    if pale_yellow_pct > 5.0 and yellow_pct < 10.0:
-        diagnoses["จุลธาตุ"].append({"name": "ขาดเหล็ก (Fe)", "description": "ใบซีดเหลืองระหว่างเส้นใบ", "recommendation": "ใส่ธาตุเหล็กคีเลต"})
-    if dark_brown_pct > 4.0 and edge_brown_pct < 4.0:
-        diagnoses["จุลธาตุ"].append({"name": "ขาดสังกะสี (Zn)", "description": "ใบมีจุดน้ำตาลเข้ม", "recommendation": "ใส่สังกะสีซัลเฟต"})
-    if brown_pct > 5.0 and purple_pct > 5.0:
-        diagnoses["จุลธาตุ"].append({"name": "ขาดทองแดง (Cu)", "description": "ใบน้ำตาลและม่วง", "recommendation": "ใส่ทองแดงซัลเฟต"})
-    
-    return diagnoses
+        st.info("ไม่พบใบในภาพ")
+
+@st.cache_resource(max_entries=2)
+def cached_dataset(key, _data):
+    from leaf_tuning import load_dataset
+
+    return load_dataset(io.BytesIO(_data))
+
+def tuning_controls():
+    # แถบเลื่อนช่วง H/S/V ของทุกแถบ (เลือกได้เฉพาะขอบ bin ของ histogram) และเกณฑ์ของทุกเงื่อนไขในตารางกฎ
+    from leaf_rules import RULES
+    from leaf_tuning import hsv_quantizer, snap_bands
+
+    edges, _ = hsv_quantizer()
+    st.sidebar.subheader("🎛 ปรับเกณฑ์")
+    bands = []
+    for name, lower, upper in snap_bands():
+        with st.sidebar.expander(f"ช่วงสี {name}"):
+            ranges = [st.select_slider(f"{channel} (ค่าบนไม่รวม)", options=edges[c].tolist(),
+                                       value=(lower[c], upper[c] + 1), key=f"tune_{name}_{channel}")
+                      for c, channel in enumerate("HSV")]
+        bands.append((name, tuple(lo for lo, _ in ranges), tuple(hi - 1 for _, hi in ranges)))
+    rules = []
+    with st.sidebar.expander("เกณฑ์ของกฎการวินิจฉัย (%)"):
+        for rule in RULES:
+            when = [(band, op, st.slider(f"{rule['name']}: {band} {op}", 0.0, 100.0, float(threshold), 0.5,
+                                         key=f"tune_{rule['id']}_{i}"))
+                    for i, (band, op, threshold) in enumerate(rule["when"])]
+            rules.append(dict(rule, when=when))
+    return tuple(bands), tuple(rules)
+
+def render_tuning(hsv_hist, meta, bands, rules):
+    # ประเมินภาพปัจจุบันใหม่จาก histogram HSV ที่แคชไว้ (ค้นตาราง SAT ไม่กี่ครั้ง) ไม่ต้องวิเคราะห์พิกเซลซ้ำ
+    from leaf_rules import build_diagnoses
+    from leaf_tuning import rescore, summed_area_table
+
+    band_pcts, disease_prob, fired, statuses = rescore(summed_area_table(hsv_hist), bands, rules)
+    st.subheader("🎛 ผลหลังปรับเกณฑ์")
+    st.dataframe([{"แถบสี": name, "เดิม (%)": round(meta["band_pcts"][name], 2), "หลังปรับ (%)": round(float(pct), 2)}
+                  for name, pct in zip(BAND_NAMES, band_pcts[0])], hide_index=True)
+    st.write(f"โอกาสที่ใบนี้จะมีปัญหา: {meta['disease_prob']:.2f}% → **{disease_prob[0]:.2f}%** · สถานะ pH: **{statuses[0]}**")
+    issues = [issue["name"] for issues in build_diagnoses(fired[0], rules).values() for issue in issues]
+    st.write("การวินิจฉัยหลังปรับ: " + (" · ".join(issues) if issues else "ไม่พบปัญหา"))
+
+def render_dataset_tuning(paths, sat, bands, rules):
+    from leaf_tuning import rescore
+
+    band_pcts, disease_prob, fired, statuses = rescore(sat, bands, rules)
+    st.subheader(f"🗂 ประเมินชุดข้อมูลใหม่ ({len(paths)} ภาพ)")
+    st.dataframe([{"กฎ": rule["name"], "จำนวนภาพ": int(count), "สัดส่วน (%)": round(count / max(len(paths), 1) * 100, 1)}
+                  for rule, count in zip(rules, fired.sum(axis=0))], hide_index=True)
+    rows = [{"path": path, "disease_prob": round(float(disease_prob[i]), 2), "ph_status": statuses[i],
+             "fired": "; ".join(rule["id"] for rule, hit in zip(rules, fired[i]) if hit)}
+            for i, path in enumerate(paths)]
+    st.dataframe(rows, hide_index=True)
+
+def render_tuning_downloads(bands, rules):
+    from leaf_rules import dump_rules
+    from leaf_tuning import dump_bands
+
+    bands_json, rules_json = io.StringIO(), io.StringIO()
+    dump_bands(bands_json, bands)
+    dump_rules(rules_json, rules)
+    st.sidebar.download_button("ดาวน์โหลดช่วงสี (bands.json)", bands_json.getvalue(), "bands.json", "application/json")
+    st.sidebar.download_button("ดาวน์โหลดตารางกฎ (rules.json)", rules_json.getvalue(), "rules.json", "application/json")
+
+@st.cache_resource
+def get_history():
+    from leaf_history import LeafHistory
+
+    return LeafHistory()
+
+def render_plant_history(plant_id, plot_id, scan_date, image_bytes, meta):
+    # บันทึกผลสแกนลงประวัติของต้น (ภาพเดิมบันทึกซ้ำไม่ได้ จึงปลอดภัยเมื่อหน้าเว็บรันใหม่) แล้วแสดงแนวโน้ม
+    from leaf_history import TREND_METRICS, TREND_WINDOW, scan_key
+
+    history = get_history()
+    record = dict(meta, **{f"{name}_pct": pct for name, pct in meta["band_pcts"].items()})
+    ts = None if scan_date == date.today() else datetime.combine(scan_date, datetime.now().time()).timestamp()
+    saved = history.add_scan(plant_id, record, ts, plot_id or None, scan_key(image_bytes))
+    rows = history.history(plant_id)
+
+    st.subheader(f"📅 ประวัติของต้น {plant_id} ({len(rows)} สแกน)")
+    if saved is None:
+        st.caption("ภาพนี้บันทึกอยู่ในประวัติของต้นนี้แล้ว")
+    chart = {"วันที่": [datetime.fromtimestamp(row["ts"]) for row in rows]}
+    chart.update((f"{metric} (เฉลี่ย {TREND_WINDOW} ครั้ง)", [row[f"{metric}_mean"] for row in rows])
+                 for metric in TREND_METRICS)
+    st.line_chart(chart, x="วันที่", y_label="%")
+    flagged = [row for row in rows if row["change_point"]]
+    if rows[-1]["change_point"]:
+        st.warning("⚠️ โอกาสเกิดปัญหาของต้นนี้สูงขึ้นอย่างมีนัยสำคัญเมื่อเทียบกับสแกนก่อนหน้า")
+    elif flagged:
+        st.info(f"พบการเพิ่มขึ้นของโอกาสเกิดปัญหาครั้งล่าสุดเมื่อ {datetime.fromtimestamp(flagged[-1]['ts']):%d/%m/%Y}")
+
+def render_live_mode():
+    from streamlit_webrtc import webrtc_streamer
+    from leaf_live import LeafVideoProcessor
+
+    st.subheader("🎥 วิเคราะห์จากกล้องสด")
+    ctx = webrtc_streamer(key="leaf-live", video_processor_factory=LeafVideoProcessor,
+                          media_stream_constraints={"video": True, "audio": False}, async_processing=True)
+    placeholder = st.empty()
+    while ctx.state.playing and ctx.video_processor:
+        try:
+            summary = ctx.video_processor.analyzer.results.get(timeout=1.0)
+        except queue.Empty:
+            continue
+        with placeholder.container():
+            cols = st.columns(len(BAND_NAMES))
+            for col, (name, pct) in zip(cols, summary["band_pcts"].items()):
+                col.metric(name, f"{pct:.2f}%")
+            st.progress(min(summary["disease_prob"] / 100, 1.0))
+            st.write(f"โอกาสที่ใบจะมีปัญหา (เฉลี่ยต่อเนื่อง): **{summary['disease_prob']:.2f}%** "
+                     f"· วิเคราะห์ทุก {summary['skip']} เฟรม")
+            issues = [issue["name"] for issues in summary["diagnoses"].values() for issue in issues]
+            if issues:
+                st.warning(" · ".join(issues))
+            else:
+                st.success("✅ ไม่พบโรคหรือการขาดธาตุอาหารที่ชัดเจน")
+
+mode = st.sidebar.radio("โหมดการใช้งาน", ("อัปโหลดภาพ", "กล้องสด"))
+if mode == "กล้องสด":
+    render_live_mode()
+    st.stop()
+
+# โหมดย่อภาพก่อนวิเคราะห์: เร็วกว่าและใช้หน่วยความจำน้อยกว่ามากสำหรับภาพจากกล้องมือถือ
+resolution_options = {"ย่อภาพ (ด้านยาวสุด 1024 px)": DEFAULT_MAX_SIDE, "ย่อภาพ (ด้านยาวสุด 2048 px)": 2048,
+                      "ความละเอียดเต็ม": None}
+resolution_label = st.sidebar.selectbox("ความละเอียดที่ใช้วิเคราะห์", list(resolution_options))
+segment = st.sidebar.checkbox("แยกใบออกจากพื้นหลัง", value=True,
+                              help="คิดเปอร์เซ็นต์เฉพาะพื้นที่ใบ ไม่นับดิน ท้องฟ้า หรือมือในภาพ")
+per_leaf = st.sidebar.checkbox("วิเคราะห์แยกทีละใบ", value=False,
+                               help="สำหรับภาพกิ่งที่มีหลายใบ: แยกแต่ละใบและแสดงผลเป็นตาราง")
+plant_id = st.sidebar.text_input("รหัสต้น (บันทึกประวัติรายต้น)", help="ระบุเพื่อบันทึกผลสแกนและดูแนวโน้มของต้นนี้ตามเวลา").strip()
+if plant_id:
+    plot_id = st.sidebar.text_input("รหัสแปลง").strip()
+    scan_date = st.sidebar.date_input("วันที่สแกน", value=date.today(), max_value=date.today())
+tune = st.sidebar.checkbox("ปรับเกณฑ์ช่วงสีและกฎ", value=False,
+                           help="ปรับช่วง HSV และเกณฑ์การวินิจฉัย แล้วดูผลกับภาพปัจจุบันหรือชุดข้อมูลทันที")
+if tune:
+    tuned_bands, tuned_rules = tuning_controls()
+    render_tuning_downloads(tuned_bands, tuned_rules)
+    dataset_file = st.sidebar.file_uploader("ชุดข้อมูล histogram (.npz จาก leaf_tuning.py build)", type=["npz"])
 
 # อัปโหลดไฟล์
-uploaded_file = st.file_uploader("เลือกภาพใบพืช (JPG, PNG, JPEG)", type=["jpg", "png", "jpeg"], 
+uploaded_file = st.file_uploader("เลือกภาพใบพืช (JPG, PNG, JPEG, TIFF)", type=["jpg", "png", "jpeg", "tif", "tiff"], 
                                help="รองรับไฟล์ภาพขนาดไม่เกิน 5MB")
 
+if uploaded_file is not None and per_leaf:
+    render_leaf_table(uploaded_file.getvalue(), resolution_options[resolution_label])
+    st.stop()
+
+get_metrics_server()
+
 if uploaded_file is not None:
-    image = Image.open(uploaded_file)
-    image_resized = image.resize((300, int(300 * image.height / image.width)))
-    st.image(image_resized, caption="ภาพใบพืชที่อัปโหลด")
+    METRICS.begin_trace()
+    with st.spinner("กำลังวิเคราะห์ภาพ..."), METRICS.stage("request_total"):
+        image_bytes = uploaded_file.getvalue()
+        max_side = resolution_options[resolution_label]
+        result_cache = get_result_cache()
+        result_cache.record_lookup()
+        arrays, meta = cached_analysis(image_key(image_bytes, max_side, segment, tune), image_bytes, max_side, segment,
+                                       tune)
+        preview_rgb, preview_codes, rgb_hist = arrays["preview_rgb"], arrays["preview_codes"], arrays["rgb_hist"]
+        (brown_pct, yellow_pct, purple_pct, edge_brown_pct, gray_pct, pale_yellow_pct,
+         dark_brown_pct) = (meta["band_pcts"][name] for name in BAND_NAMES)
+        disease_prob, ph_status, diagnoses = meta["disease_prob"], meta["ph_status"], meta["diagnoses"]
     
-    with st.spinner("กำลังวิเคราะห์ภาพ..."):
-        (brown_highlight, yellow_highlight, purple_highlight, edge_brown_highlight, gray_highlight, 
-         pale_yellow_highlight, dark_brown_highlight, img_rgb, brown_pct, yellow_pct, purple_pct, 
-         edge_brown_pct, gray_pct, pale_yellow_pct, dark_brown_pct, disease_prob, ph_status) = analyze_leaf(image)
+    # ใช้ภาพย่อจากผลวิเคราะห์ที่แคชไว้ ไม่ต้องถอดรหัสไฟล์ต้นฉบับซ้ำทุกครั้งที่หน้าเว็บรันใหม่
+    st.image(preview_rgb, caption="ภาพใบพืชที่อัปโหลด", width=PREVIEW_WIDTH)
+    with METRICS.stage("render_overlay"):
+        st.image(overlay_bands(preview_rgb, preview_codes), caption="แถบสีที่ตรวจพบทั้งหมด", width=PREVIEW_WIDTH)
+    if segment:
+        st.caption(f"พื้นที่ใบคิดเป็น {meta['leaf_fraction'] * 100:.0f}% ของภาพ เปอร์เซ็นต์ด้านล่างคิดจากพื้นที่ใบเท่านั้น")
     
     st.subheader("📊 ผลการวิเคราะห์ภาพ")
     col1, col2 = st.columns(2, gap="medium")
     
     with col1:
         st.markdown('<div class="highlight-box">', unsafe_allow_html=True)
-        brown_resized = Image.fromarray(brown_highlight).resize((200, int(200 * brown_highlight.shape[0] / brown_highlight.shape[1])))
-        st.image(brown_resized, caption="สีน้ำตาล (โรคใบไหม้)")
+        st.image(band_preview(preview_rgb, preview_codes, BAND_NAMES.index("brown")), caption="สีน้ำตาล (โรคใบไหม้)", width=200)
         st.metric("โอกาสขาดทองแดง", f"{brown_pct:.2f}%", delta=None)
-        purple_resized = Image.fromarray(purple_highlight).resize((200, int(200 * purple_highlight.shape[0] / purple_highlight.shape[1])))
-        st.image(purple_resized, caption="สีม่วง (ขาดฟอสฟอรัส)")
+        st.image(band_preview(preview_rgb, preview_codes, BAND_NAMES.index("purple")), caption="สีม่วง (ขาดฟอสฟอรัส)", width=200)
         st.metric("โอกาสขาดฟอสฟอรัส", f"{purple_pct:.2f}%", delta=None)
-        gray_resized = Image.fromarray(gray_highlight).resize((200, int(200 * gray_highlight.shape[0] / gray_highlight.shape[1])))
-        st.image(gray_resized, caption="สีเทา/ขาว (โรคราแป้ง/ขาดแคลเซียม)")
+        st.image(band_preview(preview_rgb, preview_codes, BAND_NAMES.index("gray")), caption="สีเทา/ขาว (โรคราแป้ง/ขาดแคลเซียม)", width=200)
         st.metric("โอกาสขาดแคลเซียม", f"{gray_pct:.2f}%", delta=None)
         st.markdown('</div>', unsafe_allow_html=True)
     
     with col2:
         st.markdown('<div class="highlight-box">', unsafe_allow_html=True)
-        yellow_resized = Image.fromarray(yellow_highlight).resize((200, int(200 * yellow_highlight.shape[0] / yellow_highlight.shape[1])))
-        st.image(yellow_resized, caption="สีเหลือง (ขาดไนโตรเจน)")
+        st.image(band_preview(preview_rgb, preview_codes, BAND_NAMES.index("yellow")), caption="สีเหลือง (ขาดไนโตรเจน)", width=200)
         st.metric("โอกาสขาดไนโตรเจน", f"{yellow_pct:.2f}%", delta=None)
-        edge_brown_resized = Image.fromarray(edge_brown_highlight).resize((200, int(200 * edge_brown_highlight.shape[0] / edge_brown_highlight.shape[1])))
-        st.image(edge_brown_resized, caption="ขอบน้ำตาล (ขาดโพแทสเซียม)")
+        st.image(band_preview(preview_rgb, preview_codes, BAND_NAMES.index("edge_brown")), caption="ขอบน้ำตาล (ขาดโพแทสเซียม)", width=200)
         st.metric("โอกาสขาดโพแทสเซียม", f"{edge_brown_pct:.2f}%", delta=None)
-        pale_yellow_resized = Image.fromarray(pale_yellow_highlight).resize((200, int(200 * pale_yellow_highlight.shape[0] / pale_yellow_highlight.shape[1])))
-        st.image(pale_yellow_resized, caption="สีเหลืองอ่อน (ขาดแมกนีเซียม/เหล็ก)")
+        st.image(band_preview(preview_rgb, preview_codes, BAND_NAMES.index("pale_yellow")), caption="สีเหลืองอ่อน (ขาดแมกนีเซียม/เหล็ก)", width=200)
         st.metric("โอกาสขาดแมกนีเซียม", f"{pale_yellow_pct:.2f}%", delta=None)
-        dark_brown_resized = Image.fromarray(dark_brown_highlight).resize((200, int(200 * dark_brown_highlight.shape[0] / dark_brown_highlight.shape[1])))
-        st.image(dark_brown_resized, caption="สีน้ำตาลเข้ม (จุดใบ/ขาดสังกะสี)")
+        st.image(band_preview(preview_rgb, preview_codes, BAND_NAMES.index("dark_brown")), caption="สีน้ำตาลเข้ม (จุดใบ/ขาดสังกะสี)", width=200)
         st.metric("โอกาสขาดสังกะสี", f"{dark_brown_pct:.2f}%", delta=None)
         st.markdown('</div>', unsafe_allow_html=True)
 
     st.subheader("📈 การกระจายตัวของค่าสี RGB")
-    plot_rgb_histogram(img_rgb)
+    with METRICS.stage("render_histogram"):
+        plot_rgb_histogram(rgb_hist)
 
     st.subheader("🔍 ความน่าจะเป็นของปัญหา")
     st.markdown('<div class="highlight-box">', unsafe_allow_html=True)
@@ -207,7 +345,6 @@ if uploaded_file is not None:
     st.markdown('</div>', unsafe_allow_html=True)
 
     st.subheader("🏥 การวินิจฉัยและคำแนะนำ")
-    diagnoses = disease_diagnosis(brown_pct, yellow_pct, purple_pct, edge_brown_pct, gray_pct, pale_yellow_pct, dark_brown_pct)
     
     for category, issues in diagnoses.items():
         if issues:
@@ -217,4 +354,39 @@ if uploaded_file is not None:
                     st.write(f"- **ลักษณะอาการ:** {issue['description']}")
                     st.write(f"- **คำแนะนำ:** {issue['recommendation']}")
     if not any(diagnoses.values()):
-        st.success("✅ ไม่พบโรคหรือการขาดธาตุอาหารที่ชัดเจน")
\ No newline at end of file
+        st.success("✅ ไม่พบโรคหรือการขาดธาตุอาหารที่ชัดเจน")
+
+    if plant_id:
+        with METRICS.stage("history"):
+            render_plant_history(plant_id, plot_id, scan_date, image_bytes, meta)
+
+    if tune:
+        with METRICS.stage("tuning"):
+            render_tuning(arrays["hsv_hist"], meta, tuned_bands, tuned_rules)
+
+    cache_stats = result_cache.stats()
+    st.sidebar.caption(f"แคชผลวิเคราะห์: หน่วยความจำ hit {cache_stats['memory_hits']} / miss {cache_stats['memory_misses']}, "
+                       f"ดิสก์ hit {cache_stats['disk_hits']} / miss {cache_stats['disk_misses']}")
+    for event, value in cache_stats.items():
+        METRICS.set_counter("leaf_cache_events_total", value, event=event)
+
+    trace = METRICS.end_trace()
+    with st.expander("🛠 ข้อมูลประสิทธิภาพ (debug)", expanded=False):
+        st.write("ขั้นตอนของการรันครั้งนี้ (ขั้นตอน decode/analysis ไม่ปรากฏเมื่อได้ผลจากแคช)")
+        st.dataframe([{"ขั้นตอน": r["stage"], "เวลา (ms)": round(r["ms"], 2),
+                       "หน่วยความจำที่จอง (MB)": None if r["alloc_bytes"] is None else round(r["alloc_bytes"] / 2**20, 2)}
+                      for r in trace], hide_index=True)
+        st.write("สะสมทั้งโปรเซส")
+        st.dataframe([{"ขั้นตอน": name, "จำนวนครั้ง": stats["count"],
+                       "เวลาเฉลี่ย (ms)": round(stats["seconds"] / stats["count"] * 1000, 2)}
+                      for name, stats in sorted(METRICS.snapshot().items())], hide_index=True)
+        st.json(cache_stats)
+
+if tune and dataset_file is not None:
+    dataset_bytes = dataset_file.getvalue()
+    try:
+        dataset_paths, dataset_sat = cached_dataset(image_key(dataset_bytes, "dataset"), dataset_bytes)
+    except (ValueError, KeyError, OSError) as exc:
+        st.error(f"อ่านชุดข้อมูลไม่ได้: {exc}")
+    else:
+        render_dataset_tuning(dataset_paths, dataset_sat, tuned_bands, tuned_rules)
\ No newline at end of file